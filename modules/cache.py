@@ -0,0 +1,138 @@
+import hashlib
+import os
+import pickle
+import sys
+from modules import parallel
+from modules import state
+import modules.rd_parcer.statements as Stmt
+
+# On-disk cache of parse results, keyed by the source text and the code that
+# parses it. Each entry is one file, written to a temporary name and renamed
+# into place, so processes sharing the cache only ever see whole entries.
+# Entries are pickled: the cache directory is trusted like the user's own
+# files are.
+#
+# NOTC_CACHE_DIR sets the directory (by default notc under the user's cache
+# directory) and NOTC_CACHE_SIZE its size in bytes; 0 turns the cache off.
+directory = os.environ.get('NOTC_CACHE_DIR') or os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'notc')
+maxSize = int(os.environ.get('NOTC_CACHE_SIZE', 64 << 20))
+
+# Sources up to this size are cached. Their entries take about 6 times the
+# size of the source.
+maxSourceSize = maxSize // 16
+
+_SUFFIX = '.ast'
+
+# Bumped when the layout of entries changes
+_FORMAT = 2
+
+# Modules whose code decides the tokens, trees and diagnostics of a source.
+# parallel merges the diagnostics of the pieces, and notc_lexer, if it has
+# been generated, may do the lexing.
+_MODULES = (
+    'modules.ply_lex', 'modules.lexer_rules', 'modules.lexprofile', 'modules.notc_lexer',
+    'modules.scanner', 'modules.state', 'modules.parallel',
+    'modules.rd_parcer.parser', 'modules.rd_parcer.expressions', 'modules.rd_parcer.statements',
+)
+
+_version = None
+
+# Hash of everything that an entry depends on besides the source
+def version() -> bytes:
+    global _version
+    if (_version is None):
+        digest = hashlib.sha256(f'{_FORMAT} {sys.version}'.encode())
+        for name in _MODULES:
+            module = sys.modules.get(name)
+            digest.update(f'{name} {module is not None} '.encode())
+            if (module is None): continue
+            with open(module.__file__, 'rb') as file:
+                digest.update(file.read())
+        _version = digest.digest()
+    return _version
+
+# The errors kept, and where parsing stops, depend on maxErrors too, and the
+# trees on whether they keep locations
+def key(source: str, maxErrors: int = None, locations: bool = True) -> str:
+    digest = hashlib.sha256(version())
+    digest.update(f'{maxErrors} {locations} '.encode())
+    digest.update(source.encode('utf-8', 'surrogatepass'))
+    return digest.hexdigest()
+
+
+# Like parallel.parse(), but replays the result of parsing the same source
+# before when it's in the cache. If there were errors, no statements are
+# returned.
+def parse(source: str, diagnostics: state.Diagnostics = None, locations: bool = True) -> list[Stmt.Stmt]:
+    diagnostics = diagnostics or state.Diagnostics()
+    if (maxSize <= 0): return parallel.parse(source, diagnostics, locations=locations)
+
+    name = key(source, diagnostics.maxErrors, locations)
+    entry = load(name)
+    if (entry is None):
+        found = state.Diagnostics(diagnostics.maxErrors)
+        statements = parallel.parse(source, found, locations=locations)
+        entry = (found, None if found.hadError else statements)
+        store(name, entry)
+
+    found, statements = entry
+    diagnostics.merge(found)
+    return statements or []
+
+# Returns the entry stored under name, or None. Reading an entry marks it as
+# recently used.
+def load(name: str):
+    path = os.path.join(directory, name + _SUFFIX)
+    try:
+        with open(path, 'rb') as file, parallel.gcPaused():
+            entry = pickle.load(file)
+        os.utime(path)
+    # Missing (or just evicted) and unreadable entries are misses alike
+    except Exception:
+        return None
+    return entry
+
+def store(name: str, entry):
+    # Only misses are stored, so hits don't import it
+    import tempfile
+
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, temp = tempfile.mkstemp(prefix='.', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                pickle.dump(entry, file, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp, os.path.join(directory, name + _SUFFIX))
+        except BaseException:
+            os.unlink(temp)
+            raise
+        evict()
+    # The cache is only an optimization: a failed write leaves it as it was.
+    # Trees nested too deeply to be pickled aren't cached.
+    except (OSError, RecursionError):
+        pass
+
+# Removes the least recently used entries until the cache fits in maxSize
+def evict():
+    entries = []
+    total = 0
+    with os.scandir(directory) as it:
+        for entry in it:
+            if (not entry.name.endswith(_SUFFIX)): continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+            total += stat.st_size
+    if (total <= maxSize): return
+
+    entries.sort()
+    for _, size, path in entries:
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        if (total <= maxSize): break
@@ -1,3 +1,5 @@
+import sys
+from types import SimpleNamespace
 from enum import Enum
 
 class Token(str, Enum):
@@ -68,6 +70,13 @@ class Token(str, Enum):
 # Mapping for lex library
 tokens = tuple(map(lambda name: Token[name].value, Token._member_names_,))
 
+# Small integer code for each token type, used by compact token streams
+kinds = {name: code for code, name in enumerate(tokens)}
+
+# The same codes as attributes (Kind.SEMICOLON, ...). They are plain ints, so
+# comparing and hashing them is as cheap as it gets
+Kind = SimpleNamespace(**kinds)
+
 
 # Regular expression rules
 ## Single-character tokens.
@@ -81,7 +90,7 @@ t_DOT = r'\.'
 t_MINUS = r'-'
 t_PLUS = r'\+'
 t_SEMICOLON = r';'
-#SLASH defined after comments
+t_SLASH = r'/'
 t_STAR = r'\*'
 t_PERCENT = r'\%'
 
@@ -104,56 +113,36 @@ t_BAR_BAR = r'\|\|'
 
 
 # Keywords.
-def t_BOOL(t):
-    r'bool'
-    return t
-def t_CHAR(t):
-    r'char'
-    return t
-def t_CIN(t):
-    r'cin'
-    return t
-def t_COUT(t):
-    r'cout'
-    return t
-def t_DOUBLE(t):
-    r'double'
-    return t
-def t_ELSE(t):
-    r'else'
-    return t
-def t_ENDL(t):
-    r'endl'
-    return t
-def t_FALSE(t):
-    r'false'
-    return t
-def t_FLOAT(t):
-    r'float'
-    return t
-def t_FOR(t):
-    r'for'
-    return t
-def t_IF(t):
-    r'if'
-    return t
-def t_INT(t):
-    r'int'
-    return t
-def t_SHORT(t):
-    r'short'
-    return t
-def t_TRUE(t):
-    r'true'
-    return t
-def t_WHILE(t):
-    r'while'
-    return t
+# Reserved words are matched by t_IDENTIFIER and looked up here, so the
+# master regex doesn't need one alternative (and callback) per keyword.
+reserved = {
+    'bool': Token.BOOL.value,
+    'char': Token.CHAR.value,
+    'cin': Token.CIN.value,
+    'cout': Token.COUT.value,
+    'double': Token.DOUBLE.value,
+    'else': Token.ELSE.value,
+    'endl': Token.ENDL.value,
+    'false': Token.FALSE.value,
+    'float': Token.FLOAT.value,
+    'for': Token.FOR.value,
+    'if': Token.IF.value,
+    'int': Token.INT.value,
+    'short': Token.SHORT.value,
+    'true': Token.TRUE.value,
+    'while': Token.WHILE.value,
+}
 
 
 ## Literals.
 t_CHAR_LITERAL = r'\'\w\''
-def t_IDENTIFIER(t): r'[_a-zA-Z]+(?:_|\w)*'; return t
+def t_IDENTIFIER(t):
+    r'[_a-zA-Z]\w*'
+    t.type = reserved.get(t.value, 'IDENTIFIER')
+    # Keywords share a single value string
+    if (t.type != 'IDENTIFIER'): t.value = sys.intern(t.value)
+    return t
+
 t_STRING = r'\"[^\"\n]*\"'
 def t_DECIMAL(t):
     r'\d+\.\d+'
@@ -166,25 +155,21 @@ def t_NUMBER(t):
     return t
 
 
+# Comments are skipped. String rules are tried longest first, so '//' starts
+# a comment before t_SLASH can match it
+t_ignore_comment = r'//.*'
 
-# Define a rule so we can track line numbers
-def t_newline(t):
-    r'\n+'
-    t.lexer.lineno += len(t.value)
-
-def t_ignore_comment(t):
-    r'//.*'
-    t.lexer.lineno += len(t.value)
-
-def t_SLASH(t):
-    r'/'
-    return t
-# A string containing ignored characters (spaces and tabs)
-t_ignore  = ' \t'  
+# A string containing ignored characters (spaces, tabs and newlines).
+# Line numbers are looked up from token positions when needed, so newlines
+# don't need a rule to count them
+t_ignore  = ' \t\n'
 
-def onCharError(char, line): ...
+# Reports a run of illegal characters found by lexer. Set by the scanner,
+# which keeps the diagnostics of each scan on its lexer
+def onCharError(lexer, chars, line, column): ...
 
-# Error handling rule
+# Error handling rule. The value is the whole run of illegal characters,
+# which is reported once and skipped
 def t_error(t):
-    onCharError(t.value[0], t.lexer.lineno)
-    t.lexer.skip(1)
+    onCharError(t.lexer, t.value, *t.lines.position(t.lexpos))
+    t.lexer.skip(len(t.value))
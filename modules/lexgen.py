@@ -0,0 +1,401 @@
+import ast
+import builtins
+import inspect
+import os
+import sys
+import textwrap
+import modules.ply_lex as _lex
+from modules import lexer_rules as _rules
+from modules import lexprofile as _profile
+from modules import lexsignature
+
+# Writes modules/notc_lexer.py: a scanner specialized for the rules in
+# lexer_rules. It uses the same master and dispatch regexes ply_lex builds,
+# but the token types, fixed values and rule function bodies are written
+# into a single token() for the INITIAL state, so there is no per-match
+# function table lookup, no callback and no state handling left.
+#
+#   python -m modules.lexgen                    write modules/notc_lexer.py
+#   python -m modules.lexgen --check FILE...    compare it with ply_lex
+#   python -m modules.lexgen --profile FILE...  report how often each rule
+#       matches in the files, save the counts in modules/lexprofile.py so
+#       the most frequent rules are tried first, and write notc_lexer.py
+
+outputPath = os.path.join(os.path.dirname(__file__), 'notc_lexer.py')
+profilePath = os.path.join(os.path.dirname(__file__), 'lexprofile.py')
+
+# Rewrites the body of a rule function so it works on the `value` and
+# `toktype` locals of the generated token(). Raises Unsupported when the
+# function does anything else with the token, so it's called instead.
+class Unsupported(Exception): ...
+
+class _Inliner(ast.NodeTransformer):
+    def __init__(self, param, ruleGlobals):
+        self.param = param
+        self.ruleGlobals = ruleGlobals
+        self.locals = set()
+        self.aliases = {}
+
+    def visit_Attribute(self, node):
+        if (isinstance(node.value, ast.Name) and node.value.id == self.param):
+            if (node.attr == 'value'): return ast.copy_location(ast.Name('value', node.ctx), node)
+            if (node.attr == 'type'): return ast.copy_location(ast.Name('toktype', node.ctx), node)
+            raise Unsupported(f't.{node.attr}')
+        return self.generic_visit(node)
+
+    def visit_Name(self, node):
+        if (node.id == self.param): raise Unsupported('t')
+        if (node.id in self.locals): return ast.copy_location(ast.Name('_v_' + node.id, node.ctx), node)
+        if (node.id not in self.ruleGlobals and hasattr(builtins, node.id)): return node
+        if (node.id not in self.ruleGlobals): raise Unsupported(node.id)
+        self.aliases[node.id] = '_r_' + node.id
+        return ast.copy_location(ast.Name('_r_' + node.id, node.ctx), node)
+
+    def _unsupported(self, node):
+        raise Unsupported(type(node).__name__)
+
+    visit_Return = visit_Yield = visit_YieldFrom = visit_Await = _unsupported
+    visit_Global = visit_Nonlocal = visit_FunctionDef = visit_AsyncFunctionDef = _unsupported
+    visit_ClassDef = visit_Lambda = visit_Delete = _unsupported
+
+# Returns (code, aliases) for the body of a rule function, or None when it
+# can't be inlined
+def inlineRule(func):
+    try:
+        tree = ast.parse(textwrap.dedent(inspect.getsource(func)))
+    except (OSError, TypeError, SyntaxError):
+        return None
+    funcDef = tree.body[0]
+    args = funcDef.args
+    if (len(args.args) != 1 or args.vararg or args.kwarg or args.kwonlyargs or funcDef.decorator_list):
+        return None
+
+    param = args.args[0].arg
+    body = funcDef.body
+    if (isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Constant)):
+        body = body[1:]
+    last = body[-1] if body else None
+    if (not (isinstance(last, ast.Return) and isinstance(last.value, ast.Name) and last.value.id == param)):
+        return None
+    body = body[:-1]
+
+    inliner = _Inliner(param, func.__globals__)
+    module = ast.Module(body=body, type_ignores=[])
+    for node in ast.walk(module):
+        if (isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store) and node.id != param):
+            inliner.locals.add(node.id)
+    try:
+        module = ast.fix_missing_locations(inliner.visit(module))
+    except Unsupported:
+        return None
+    return ast.unparse(module), inliner.aliases
+
+def _indent(code, depth):
+    return textwrap.indent(code, '    ' * depth)
+
+# Returns the source of the specialized scanner module
+def generate():
+    lexer = _lex.lex(module=_rules, profile=_profile.counts)
+
+    # Rule ids: function rules first, in the order of the master regex, so
+    # `r < funcCount` tells the generated code to run a function body
+    names = [name for names in lexer.lexstaterenames['INITIAL'] for name in names if name]
+    ruleGlobals = vars(_rules)
+    funcNames = [name for name in names if inspect.isfunction(ruleGlobals.get(name))]
+    ruleIds = {name: i for i, name in enumerate(funcNames + [n for n in names if n not in funcNames])}
+    ruleTypes = [None] * len(ruleIds)
+    for lexre, lexindexfunc in lexer.lexstatere['INITIAL']:
+        for name, i in lexre.groupindex.items():
+            ruleTypes[ruleIds[name]] = lexindexfunc[i][1]
+    ruleValues = [lexer.lexfixed.get(toktype) for toktype in ruleTypes]
+
+    regexes = {}
+    def regexList(lexres):
+        entries = []
+        for lexre, lexindexfunc in lexres:
+            key = (lexre.pattern, lexre.flags)
+            if (key not in regexes):
+                regexes[key] = f'_re{len(regexes)}'
+            groups = [None] * len(lexindexfunc)
+            for name, i in lexre.groupindex.items():
+                groups[i] = ruleIds[name]
+            entries.append(f'({regexes[key]}, {tuple(groups)!r})')
+        return '(' + ''.join(entry + ', ' for entry in entries) + ')'
+
+    master = regexList(lexer.lexstatere['INITIAL'])
+    dispatch = []
+    for char, entry in sorted(lexer.lexstatedispatch['INITIAL'].items()):
+        dispatch.append(f'    {char!r}: {entry!r},' if isinstance(entry, str) else f'    {char!r}: {regexList(entry)},')
+
+    aliases = {}
+    branches = []
+    for r, name in enumerate(funcNames):
+        inlined = inlineRule(ruleGlobals[name])
+        if (inlined):
+            code, used = inlined
+            aliases.update(used)
+            branches.append((r, name, code))
+        else:
+            aliases[name] = '_r_' + name
+            branches.append((r, name, None))
+
+    out = []
+    emit = out.append
+    emit('# Generated by modules/lexgen.py from modules/lexer_rules.py, do not edit.')
+    emit('# Run `python -m modules.lexgen` again after changing the rules.')
+    emit('import re')
+    emit('from modules.ply_lex import LexToken, LexError, LineIndex, _error_run_end')
+    emit('from modules import lexer_rules as _rules')
+    emit('')
+    emit(f'tabversion = {_lex.__tabversion__!r}')
+    emit(f'signature = {lexsignature.signature()!r}')
+    emit('')
+    for name, alias in sorted(aliases.items()):
+        emit(f'{alias} = _rules.{name}')
+    emit(f'_errorf = _rules.{lexer.lexerrorf.__name__}' if lexer.lexerrorf else '_errorf = None')
+    emit('')
+    for (pattern, flags), var in regexes.items():
+        emit(f'{var} = re.compile({pattern!r}, {flags})')
+    emit('')
+    emit(f'_ignore = {lexer.lexignore!r}')
+    emit(f'_ignorere = re.compile({lexer.lexignorere.pattern!r})' if lexer.lexignorere else '_ignorere = None')
+    emit(f'_literals = {lexer.lexliterals!r}')
+    emit(f'_types = {tuple(ruleTypes)!r}')
+    emit(f'_values = {tuple(ruleValues)!r}')
+    emit(f'_master = {master}')
+    emit('_dispatch = {')
+    out.extend(dispatch)
+    emit('}')
+    emit('')
+    emit(_CLASS_HEAD)
+
+    emit('                r = ruleids[m.lastindex]')
+    if (branches):
+        emit(f'                if (r < {len(branches)}):')
+        emit('                    value = m.group()')
+        for n, (r, name, code) in enumerate(branches):
+            emit(f'                    {"if" if n == 0 else "elif"} (r == {r}):')
+            emit(f'                        # {name}')
+            emit(f'                        toktype = {ruleTypes[r]!r}')
+            if (code is None):
+                emit(_indent(_CALL_RULE % ('_r_' + name), 6))
+            elif (code):
+                emit(_indent(code, 6))
+        emit('                else:')
+        emit('                    toktype = _types[r]')
+        emit('                    if (toktype is None):')
+        emit('                        lexpos = m.end()')
+        emit('                        break')
+        emit('                    value = _values[r] or m.group()')
+    else:
+        emit('                toktype = _types[r]')
+        emit('                if (toktype is None):')
+        emit('                    lexpos = m.end()')
+        emit('                    break')
+        emit('                value = _values[r] or m.group()')
+    emit(_CLASS_TAIL)
+    return '\n'.join(out) + '\n'
+
+_CLASS_HEAD = '''\
+class Lexer:
+    def __init__(self):
+        self.lexdata = None
+        self.lexpos = 0
+        self.lexlen = 0
+        self.lexlines = None
+        self.lexerrorcount = 0
+        self.lexmaxerrors = None
+
+    # The tables are module constants, so a clone only needs its own position
+    def clone(self):
+        c = Lexer()
+        c.lexmaxerrors = self.lexmaxerrors
+        return c
+
+    def input(self, s):
+        self.lexdata = s
+        self.lexpos = 0
+        self.lexlen = len(s)
+        self.lexlines = LineIndex(s)
+        self.lexerrorcount = 0
+
+    @property
+    def lineno(self):
+        if self.lexlines is None:
+            return 1
+        return self.lexlines.line(self.lexpos)
+
+    def skip(self, n):
+        self.lexpos += n
+
+    def _error_run(self, lexpos):
+        self.lexerrorcount += 1
+        end = _error_run_end(self.lexdata, lexpos, _master, _ignore, _literals)
+        if self.lexmaxerrors is not None and self.lexerrorcount > self.lexmaxerrors:
+            self.lexpos = lexpos
+            raise LexError(f'Too many errors, stopped after {self.lexmaxerrors}', self.lexdata[lexpos:end])
+        return end
+
+    def token(self):
+        lexpos = self.lexpos
+        lexlen = self.lexlen
+        lexdata = self.lexdata
+        lexlines = self.lexlines
+
+        while lexpos < lexlen:
+            c = lexdata[lexpos]
+            if c in _ignore:
+                lexpos = _ignorere.match(lexdata, lexpos).end()
+                continue
+
+            lexres = _dispatch.get(c, _master)
+            if lexres.__class__ is str:
+                tok = LexToken()
+                tok.value = c
+                tok.lines = lexlines
+                tok.type = lexres
+                tok.lexpos = lexpos
+                self.lexpos = lexpos + 1
+                return tok
+
+            for lexre, ruleids in lexres:
+                m = lexre.match(lexdata, lexpos)
+                if not m:
+                    continue
+'''
+
+_CALL_RULE = '''\
+tok = LexToken()
+tok.value = value
+tok.lines = lexlines
+tok.type = toktype
+tok.lexpos = lexpos
+tok.lexer = self
+self.lexmatch = m
+self.lexpos = lexpos = m.end()
+newtok = %s(tok)
+del tok.lexer
+del self.lexmatch
+if not newtok:
+    lexpos = self.lexpos
+    break
+return newtok'''
+
+_CLASS_TAIL = '''\
+                tok = LexToken()
+                tok.value = value
+                tok.lines = lexlines
+                tok.type = toktype
+                tok.lexpos = lexpos
+                self.lexpos = m.end()
+                return tok
+            else:
+                if c in _literals:
+                    tok = LexToken()
+                    tok.value = c
+                    tok.lines = lexlines
+                    tok.type = c
+                    tok.lexpos = lexpos
+                    self.lexpos = lexpos + 1
+                    return tok
+
+                if _errorf:
+                    end = self._error_run(lexpos)
+                    tok = LexToken()
+                    tok.value = lexdata[lexpos:end]
+                    tok.lines = lexlines
+                    tok.type = 'error'
+                    tok.lexer = self
+                    tok.lexpos = lexpos
+                    self.lexpos = lexpos
+                    newtok = _errorf(tok)
+                    if lexpos == self.lexpos:
+                        raise LexError(f"Scanning error. Illegal character {c!r}", lexdata[lexpos:])
+                    lexpos = self.lexpos
+                    if not newtok:
+                        continue
+                    return newtok
+
+                self.lexpos = lexpos
+                raise LexError(f"Illegal character {c!r} at index {lexpos}", lexdata[lexpos:])
+
+        self.lexpos = lexpos + 1
+        if self.lexdata is None:
+            raise RuntimeError('No input string given with input()')
+        return None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        t = self.token()
+        if t is None:
+            raise StopIteration
+        return t'''
+
+def _writeFile(path, source):
+    temp = path + '.tmp'
+    with open(temp, 'w') as file:
+        file.write(source)
+    os.replace(temp, path)
+
+def write(path=outputPath):
+    _writeFile(path, generate())
+
+# Lexes the files with profiling on, prints the report and saves the match
+# counts of the rules
+def profile(paths):
+    lexer = _lex.lex(module=_rules)
+    stats = lexer.start_profile()
+    for path in paths:
+        with open(path) as file:
+            lexer.input(file.read())
+        for token in iter(lexer.token, None): pass
+    _lex.profile_report(stats)
+
+    names = [name for names in lexer.lexstaterenames['INITIAL'] for name in names if name in stats]
+    counts = {name: stats[name][0] for name in sorted(names, key=lambda name: -stats[name][0])}
+    _writeFile(profilePath, '\n'.join([
+        '# Generated by `python -m modules.lexgen --profile`: how often each lexer',
+        '# rule matched on the corpus. ply_lex tries the most frequent rules first.',
+        'counts = {', *(f'    {name!r}: {count},' for name, count in counts.items()), '}', '']))
+    _profile.counts = counts
+
+# Lexes every file with both scanners and reports the first difference in
+# the tokens or the illegal characters reported. Returns the number of files
+# that differ. Exits if the scanner hasn't been generated yet.
+def check(paths):
+    try:
+        from modules import notc_lexer
+    except ImportError:
+        sys.exit(f'{outputPath} not found: run `python -m modules.lexgen` first')
+    plyLexer = _lex.lex(module=_rules)
+    onCharError = _rules.onCharError
+    failed = 0
+    for path in paths:
+        with open(path) as file:
+            source = file.read()
+        streams = []
+        for lexer in (plyLexer.clone(), notc_lexer.Lexer()):
+            stream = []
+            _rules.onCharError = lambda lexer, chars, line, column: stream.append(('error', chars, line, column))
+            lexer.input(source)
+            stream.extend((t.type, t.value, t.lexpos) for t in iter(lexer.token, None))
+            stream.append(lexer.lexpos)
+            streams.append(stream)
+        _rules.onCharError = onCharError
+
+        expected, actual = streams
+        if (expected != actual):
+            failed += 1
+            i = next((i for i, (a, b) in enumerate(zip(expected, actual)) if a != b), min(len(expected), len(actual)))
+            print(f'{path}: token {i} differs: {expected[i:i+1]} != {actual[i:i+1]}')
+    print(f'{len(paths) - failed} of {len(paths)} files lexed identically')
+    return failed
+
+if __name__ == '__main__':
+    if (sys.argv[1:2] == ['--check']):
+        sys.exit(1 if check(sys.argv[2:]) else 0)
+    if (sys.argv[1:2] == ['--profile']):
+        profile(sys.argv[2:])
+    write()
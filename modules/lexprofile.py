@@ -0,0 +1,24 @@
+# Generated by `python -m modules.lexgen --profile`: how often each lexer
+# rule matched on the corpus. ply_lex tries the most frequent rules first.
+counts = {
+    't_IDENTIFIER': 60,
+    't_SEMICOLON': 20,
+    't_EQUAL': 12,
+    't_NUMBER': 10,
+    't_LESS_LESS': 10,
+    't_LEFT_PAREN': 6,
+    't_RIGHT_PAREN': 6,
+    't_STRING': 5,
+    't_LEFT_BRACE': 5,
+    't_RIGHT_BRACE': 5,
+    't_EQUAL_EQUAL': 3,
+    't_PLUS': 3,
+    't_GREATER_GREATER': 2,
+    't_COMMA': 2,
+    't_LESS': 2,
+    't_BAR_BAR': 1,
+    't_ignore_comment': 1,
+    't_LESS_EQUAL': 1,
+    't_PERCENT': 1,
+    't_SLASH': 1,
+}
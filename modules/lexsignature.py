@@ -0,0 +1,20 @@
+import hashlib
+import os
+import modules.ply_lex as _lex
+from modules import lexer_rules as _rules
+from modules import lexprofile as _profile
+
+# Identifies what the scanner generated by modules/lexgen.py is made from:
+# the rules and their profile, and the source of the generator and of
+# ply_lex, whose token loop it copies. Kept apart from lexgen so that
+# checking a generated scanner doesn't import the generator. None if the
+# sources can't be read, in which case no generated scanner is used.
+def signature() -> str:
+    parts = [_lex.lex_signature(module=_rules, code=True, profile=_profile.counts)]
+    for path in (os.path.join(os.path.dirname(__file__), 'lexgen.py'), _lex.__file__):
+        try:
+            with open(path, 'rb') as file:
+                parts.append(hashlib.sha256(file.read()).hexdigest())
+        except OSError:
+            return None
+    return hashlib.sha256(' '.join(parts).encode()).hexdigest()
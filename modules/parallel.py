@@ -0,0 +1,142 @@
+import contextlib
+import gc
+from itertools import repeat
+import os
+import re
+from modules import scanner
+from modules import state
+from modules.rd_parcer.parser import RDParser
+import modules.rd_parcer.statements as Stmt
+
+# Sources are only split in pieces of at least this size; smaller ones are
+# lexed and parsed in this process
+minChunkSize = 1 << 20
+
+# Lexes and parses source in a pool of processes and returns its statements,
+# reporting the same diagnostics in the same order as parsing it in one go.
+#
+# The text is cut at line starts that end a top-level statement. No lexer
+# rule matches across a newline, so each piece lexes to the same tokens as
+# it would within the whole text. A piece that parses without errors ends
+# where the parser of the whole text would be between two declarations, so
+# the next piece starts in the same state. When a piece other than the last
+# has parse errors, the error recovery could have carried on past its end,
+# so everything from that piece on is parsed again as one. Errors are added
+# to diagnostics. locations is passed on to RDParser.
+def parse(source: str, diagnostics: state.Diagnostics = None, maxWorkers: int = None,
+        locations: bool = True) -> list[Stmt.Stmt]:
+    with gcPaused():
+        return _parse(source, diagnostics or state.Diagnostics(), maxWorkers, locations)
+
+def _parseWhole(source: str, diagnostics: state.Diagnostics, locations: bool) -> list[Stmt.Stmt]:
+    return RDParser(scanner.tokenize_all(source, diagnostics=diagnostics), diagnostics, locations).parse()
+
+def _parse(source: str, diagnostics: state.Diagnostics, maxWorkers: int, locations: bool) -> list[Stmt.Stmt]:
+    workers = maxWorkers or os.cpu_count() or 1
+    pieces = min(workers * 4, len(source) // minChunkSize)
+    starts = _splitPoints(source, pieces) if (workers > 1) else [0]
+    if (len(starts) < 2):
+        return _parseWhole(source, diagnostics, locations)
+
+    ends = starts[1:] + [len(source)]
+    firstLines = [1]
+    for start, end in zip(starts, ends[:-1]):
+        firstLines.append(firstLines[-1] + source.count('\n', start, end))
+
+    # Only imported for sources that are split, as it loads multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_parseChunk,
+                [source[start:end] for start, end in zip(starts, ends)], firstLines, starts,
+                repeat(diagnostics.maxErrors), repeat(locations)))
+    # Trees nested too deeply to be pickled can't be sent back
+    except RecursionError:
+        return _parseWhole(source, diagnostics, locations)
+
+    for i, result in enumerate(results[:-1]):
+        if (result[2].hadError):
+            results[i:] = [_parsePiece(source[starts[i]:], firstLines[i], starts[i], diagnostics.maxErrors, locations)]
+            break
+
+    # The lexer gives up after scanner.maxErrors over the whole text
+    if (sum(result[3] for result in results) > scanner.maxErrors):
+        return _parseWhole(source, diagnostics, locations)
+
+    # All lexer errors are reported before the parser starts
+    statements: list[Stmt.Stmt] = []
+    for result in results: diagnostics.merge(result[1])
+    for result in results:
+        diagnostics.merge(result[2])
+        statements += result[0]
+    return statements
+
+# Lexes and parses a piece of a larger text, which starts at line firstLine
+# and position base. Returns (statements, lexer diagnostics, parser
+# diagnostics, number of lexer errors). The parser keeps what's left of
+# maxErrors after the lexer errors.
+def _parseChunk(source: str, firstLine: int, base: int, maxErrors: int, locations: bool):
+    with gcPaused():
+        return _parsePiece(source, firstLine, base, maxErrors, locations)
+
+def _parsePiece(source: str, firstLine: int, base: int, maxErrors: int, locations: bool):
+    lexDiagnostics = state.Diagnostics(maxErrors)
+    tokens = scanner.tokenize_all(source, firstLine, base, lexDiagnostics)
+
+    if (maxErrors is not None): maxErrors = max(maxErrors - lexDiagnostics.errorCount, 0)
+    parseDiagnostics = state.Diagnostics(maxErrors)
+    statements = RDParser(tokens, parseDiagnostics, locations).parse()
+
+    return statements, lexDiagnostics, parseDiagnostics, tokens.errorCount
+
+# Tokens and trees don't form reference cycles, so the cyclic garbage
+# collector has nothing to find in them. Left running, it would walk all of
+# them again and again while they're being built or unpickled.
+@contextlib.contextmanager
+def gcPaused():
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if (enabled): gc.enable()
+
+
+# Strings and comments, which may hold brackets that aren't tokens. Neither
+# spans lines, so matching from a line start finds the same ones as the lexer
+_quoted_re = re.compile(r'//[^\n]*|"[^"\n]*"')
+_else_re = re.compile(r'(?:\s|//[^\n]*)*else\b')
+
+# Open brackets, '(' and '{' alike, in the tokens of text
+def _depth(text: str) -> int:
+    quoted = ''.join(_quoted_re.findall(text))
+    return (text.count('{') + text.count('(') - text.count('}') - text.count(')')
+        - quoted.count('{') - quoted.count('(') + quoted.count('}') + quoted.count(')'))
+
+# Returns the positions where source is cut into about `pieces` pieces,
+# starting with 0. Each cut is at the first line start after the even split
+# point where all brackets are closed, the line before ends with ';' or '}'
+# (outside comments) and the next token isn't 'else'. A cut that's wrong
+# for invalid input only makes the piece before it fail to parse cleanly.
+def _splitPoints(source: str, pieces: int) -> list[int]:
+    starts = [0]
+    depth = 0
+    line = 0
+    for target in range(1, pieces):
+        target = source.find('\n', len(source) * target // pieces) + 1
+        if (target <= line): continue
+
+        depth += _depth(source[line:target])
+        line = target
+        while (line < len(source)):
+            if (depth == 0):
+                before = source[source.rfind('\n', 0, line - 1) + 1:line].rstrip()
+                if (before.endswith((';', '}')) and '//' not in before
+                        and not _else_re.match(source, line)):
+                    starts.append(line)
+                    break
+
+            end = source.find('\n', line) + 1 or len(source)
+            depth += _depth(source[line:end])
+            line = end
+    return starts
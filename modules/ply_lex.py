@@ -36,9 +36,16 @@
 import re
 import sys
 import types
+from array import array
+from bisect import bisect_left
 import copy
 import os
-import inspect
+import hashlib
+import importlib
+import time
+
+# Version of the table format written by Lexer.writetab()
+__tabversion__ = '2022.4'
 
 # This tuple contains acceptable string types
 StringTypes = (str, bytes)
@@ -53,10 +60,88 @@ class LexError(Exception):
         self.args = (message,)
         self.text = s
 
-# Token class.  This class is used to represent the tokens produced.
+# -----------------------------------------------------------------------------
+# LineIndex
+#
+# Maps positions in an input string to line and column numbers.  The offsets
+# of the newlines are only collected the first time a line number is asked
+# for, so lexing itself never has to track lines.  base and firstline allow an
+# index over one piece of a larger text to answer for positions in the whole.
+# -----------------------------------------------------------------------------
+_newline_re = re.compile('\n')
+
+class LineIndex(object):
+    __slots__ = ('text', 'base', 'firstline', '_newlines')
+
+    def __init__(self, text, firstline=1, base=0):
+        self.text = text
+        self.base = base
+        self.firstline = firstline
+        self._newlines = None
+
+    # Replace the indexed text, e.g. after an edit
+    def update(self, text):
+        self.text = text
+        self._newlines = None
+
+    # Returns an index over the same text for positions shifted by base
+    def shifted(self, base):
+        c = LineIndex(self.text, self.firstline, base)
+        c._newlines = self._newlines
+        return c
+
+    def newlines(self):
+        if self._newlines is None:
+            self._newlines = array('q', [m.start() for m in _newline_re.finditer(self.text)])
+        return self._newlines
+
+    def line(self, pos):
+        return self.firstline + bisect_left(self.newlines(), pos - self.base)
+
+    # Returns (line, column) for a position, both starting at 1
+    def position(self, pos):
+        pos -= self.base
+        newlines = self.newlines()
+        n = bisect_left(newlines, pos)
+        linestart = newlines[n-1] + 1 if n else 0
+        return (self.firstline + n, pos - linestart + 1)
+
+    # Pickled indexes only keep what position lookups need, not the text
+    def __getstate__(self):
+        return (self.base, self.firstline, self.newlines())
+
+    def __setstate__(self, state):
+        self.base, self.firstline, self._newlines = state
+        self.text = None
+
+# Token class.  This class is used to represent the tokens produced.  Tokens
+# have a fixed set of fields so that creating one never allocates a dict.
+# lexer is only set while a token is being passed to a rule function.  Line
+# and column numbers are looked up from lexpos when asked for; they are None
+# for tokens kept without a line index or position, such as those of
+# diagnostics, arena views and loaded trees.
 class LexToken(object):
+    __slots__ = ('type', 'value', 'lexpos', 'lines', 'lexer')
+
+    @property
+    def lineno(self):
+        position = self._position()
+        return position and position[0]
+
+    @property
+    def column(self):
+        position = self._position()
+        return position and position[1]
+
+    def _position(self):
+        lines = getattr(self, 'lines', None)
+        lexpos = getattr(self, 'lexpos', None)
+        if lines is None or lexpos is None:
+            return None
+        return lines.position(lexpos)
+
     def __repr__(self):
-        return f'LexToken({self.type},{self.value!r},{self.lineno},{self.lexpos})'
+        return f"LexToken({self.type},{self.value!r},{self.lineno},{getattr(self, 'lexpos', None)})"
 
 # This object is a stand-in for a logging object created by the
 # logging module.
@@ -87,7 +172,8 @@ class PlyLogger(object):
 #    token()          -  Get the next token
 #    clone()          -  Clone the lexer
 #
-#    lineno           -  Current line number
+#    lineno           -  Line number of the current position
+#    lexlines         -  LineIndex of the input string
 #    lexpos           -  Current position in the input string
 # -----------------------------------------------------------------------------
 
@@ -101,6 +187,9 @@ class Lexer:
         self.lexstatere = {}          # Dictionary mapping lexer states to master regexs
         self.lexstateretext = {}      # Dictionary mapping lexer states to regex strings
         self.lexstaterenames = {}     # Dictionary mapping lexer states to symbol names
+        self.lexdispatch = {}         # First character -> token name or regexs to try
+        self.lexstatedispatch = {}    # Dictionary mapping lexer states to dispatch tables
+        self.lexfixed = {}            # Token name -> value, for tokens that are a fixed string
         self.lexstate = 'INITIAL'     # Current lexer state
         self.lexstatestack = []       # Stack of lexer states
         self.lexstateinfo = None      # State information
@@ -112,15 +201,21 @@ class Lexer:
         self.lexpos = 0               # Current position in input text
         self.lexlen = 0               # Length of the input text
         self.lexerrorf = None         # Error rule (if any)
+        self.lexerrorcount = 0        # Number of times the error rule was called
+        self.lexmaxerrors = None      # Raise LexError when there are more errors than this
         self.lexeoff = None           # EOF rule (if any)
         self.lextokens = None         # List of valid tokens
         self.lexignore = ''           # Ignored characters
+        self.lexignorere = None       # Regex matching a run of ignored characters
         self.lexliterals = ''         # Literal characters that can be passed through
         self.lexmodule = None         # Module
-        self.lineno = 1               # Current line number
+        self.lexlines = None          # LineIndex of the input string
+        self.lexprofile = None        # Rule name -> [matches, bytes, seconds] while profiling
+        self.lexprofilenames = None   # Regex -> group names, while profiling
 
     def clone(self, object=None):
         c = copy.copy(self)
+        c.lexstatestack = []
 
         # If the object parameter has been supplied, it means we are attaching the
         # lexer to a new object.  In this case, we have to rebind all methods in
@@ -140,12 +235,135 @@ class Lexer:
                 newre.append((cre, newfindex))
                 newtab[key] = newre
             c.lexstatere = newtab
+            newdispatch = {}
+            for key, dtab in self.lexstatedispatch.items():
+                newdtab = {}
+                for char, entry in dtab.items():
+                    if isinstance(entry, str):
+                        newdtab[char] = entry
+                        continue
+                    newdtab[char] = [(cre, [f if not f or not f[0] else (getattr(object, f[0].__name__), f[1])
+                                            for f in findex])
+                                     for cre, findex in entry]
+                newdispatch[key] = newdtab
+            c.lexstatedispatch = newdispatch
             c.lexstateerrorf = {}
             for key, ef in self.lexstateerrorf.items():
                 c.lexstateerrorf[key] = getattr(object, ef.__name__)
             c.lexmodule = object
+        if c.lexprofile is not None:
+            c.token = types.MethodType(_profiled_token(), c)
         return c
 
+    # ------------------------------------------------------------
+    # writetab() - Write lexer information to a table file
+    # ------------------------------------------------------------
+    def writetab(self, lextab, outputdir='', signature=None):
+        basetabmodule = lextab.split('.')[-1]
+        filename = os.path.join(outputdir, basetabmodule) + '.py'
+
+        # Rewrite the lexstatere table, replacing function objects with function names
+        tabre = {}
+        for statename, lre in self.lexstatere.items():
+            titem = []
+            for (pat, func), retext, renames in zip(lre, self.lexstateretext[statename], self.lexstaterenames[statename]):
+                titem.append((retext, _funcs_to_names(func, renames)))
+            tabre[statename] = titem
+
+        taberr = {}
+        for statename, ef in self.lexstateerrorf.items():
+            taberr[statename] = ef.__name__ if ef else None
+
+        tabeof = {}
+        for statename, ef in self.lexstateeoff.items():
+            tabeof[statename] = ef.__name__ if ef else None
+
+        tabdispatch = {}
+        for statename, dtab in self.lexstatedispatch.items():
+            titem = {}
+            for char, entry in dtab.items():
+                if isinstance(entry, str):
+                    titem[char] = entry
+                    continue
+                titem[char] = [(cre.pattern, _funcs_to_names(findex, _group_names(cre, findex)))
+                               for cre, findex in entry]
+            tabdispatch[statename] = titem
+
+        # Write to a temporary file first so that concurrent readers never
+        # see a partially written table
+        tmpname = f'{filename}.{os.getpid()}.tmp'
+        with open(tmpname, 'w') as tf:
+            tf.write(f"# {basetabmodule}.py. This file automatically created by PLY. Don't edit!\n")
+            tf.write(f'_tabversion   = {__tabversion__!r}\n')
+            tf.write(f'_lexsignature = {signature!r}\n')
+            tf.write(f'_lextokens    = set({tuple(sorted(self.lextokens))!r})\n')
+            tf.write(f'_lexreflags   = {int(self.lexreflags)!r}\n')
+            tf.write(f'_lexliterals  = {self.lexliterals!r}\n')
+            tf.write(f'_lexstateinfo = {self.lexstateinfo!r}\n')
+            tf.write(f'_lexstatere   = {tabre!r}\n')
+            tf.write(f'_lexstateignore = {self.lexstateignore!r}\n')
+            tf.write(f'_lexstateerrorf = {taberr!r}\n')
+            tf.write(f'_lexstateeoff = {tabeof!r}\n')
+            tf.write(f'_lexstatedispatch = {tabdispatch!r}\n')
+            tf.write(f'_lexfixed = {self.lexfixed!r}\n')
+        os.replace(tmpname, filename)
+
+    # ------------------------------------------------------------
+    # readtab() - Read lexer information from a table file
+    # ------------------------------------------------------------
+    def readtab(self, tabfile, fdict, signature=None):
+        lextab = importlib.import_module(tabfile)
+
+        if getattr(lextab, '_tabversion', '0.0') != __tabversion__:
+            raise ImportError('Inconsistent PLY version')
+
+        if getattr(lextab, '_lexsignature', None) != signature:
+            raise ImportError('Lexer rules have changed')
+
+        self.lextokens      = lextab._lextokens
+        self.lexreflags     = lextab._lexreflags
+        self.lexliterals    = lextab._lexliterals
+        self.lextokens_all  = self.lextokens | set(self.lexliterals)
+        self.lexstateinfo   = lextab._lexstateinfo
+        self.lexstateignore = lextab._lexstateignore
+        self.lexstatere     = {}
+        self.lexstateretext = {}
+        self.lexstaterenames = {}
+        for statename, lre in lextab._lexstatere.items():
+            titem = []
+            txtitem = []
+            nameitem = []
+            for pat, func_name in lre:
+                titem.append((re.compile(pat, lextab._lexreflags), _names_to_funcs(func_name, fdict)))
+                txtitem.append(pat)
+                nameitem.append([n and n[0] for n in func_name])
+
+            self.lexstatere[statename] = titem
+            self.lexstateretext[statename] = txtitem
+            self.lexstaterenames[statename] = nameitem
+
+        self.lexstateerrorf = {}
+        for statename, ef in lextab._lexstateerrorf.items():
+            self.lexstateerrorf[statename] = fdict[ef] if ef else None
+
+        self.lexstateeoff = {}
+        for statename, ef in lextab._lexstateeoff.items():
+            self.lexstateeoff[statename] = fdict[ef] if ef else None
+
+        self.lexfixed = lextab._lexfixed
+        self.lexstatedispatch = {}
+        for statename, dtab in lextab._lexstatedispatch.items():
+            titem = {}
+            for char, entry in dtab.items():
+                if isinstance(entry, str):
+                    titem[char] = entry
+                    continue
+                titem[char] = [(re.compile(pat, lextab._lexreflags), _names_to_funcs(func_name, fdict))
+                               for pat, func_name in entry]
+            self.lexstatedispatch[statename] = titem
+
+        self.begin('INITIAL')
+
     # ------------------------------------------------------------
     # input() - Push a new string into the lexer
     # ------------------------------------------------------------
@@ -153,6 +371,17 @@ class Lexer:
         self.lexdata = s
         self.lexpos = 0
         self.lexlen = len(s)
+        self.lexlines = LineIndex(s)
+        self.lexerrorcount = 0
+
+    # ------------------------------------------------------------
+    # lineno - Line number of the current position
+    # ------------------------------------------------------------
+    @property
+    def lineno(self):
+        if self.lexlines is None:
+            return 1
+        return self.lexlines.line(self.lexpos)
 
     # ------------------------------------------------------------
     # begin() - Changes the lexing state
@@ -162,7 +391,9 @@ class Lexer:
             raise ValueError(f'Undefined state {state!r}')
         self.lexre = self.lexstatere[state]
         self.lexretext = self.lexstateretext[state]
+        self.lexdispatch = self.lexstatedispatch.get(state, {})
         self.lexignore = self.lexstateignore.get(state, '')
+        self.lexignorere = _ignore_re(self.lexignore)
         self.lexerrorf = self.lexstateerrorf.get(state, None)
         self.lexeoff = self.lexstateeoff.get(state, None)
         self.lexstate = state
@@ -186,6 +417,27 @@ class Lexer:
     def current_state(self):
         return self.lexstate
 
+    # ------------------------------------------------------------
+    # start_profile() - Record, for every rule, the number of matches,
+    # the number of characters matched and the time spent in the rule
+    # function.  Statistics are added to the supplied dictionary (shared
+    # with clones made afterwards), which is returned.
+    # ------------------------------------------------------------
+    def start_profile(self, profile=None):
+        self.lexprofile = {} if profile is None else profile
+        self.lexprofilenames = {}
+        self.token = types.MethodType(_profiled_token(), self)
+        return self.lexprofile
+
+    # ------------------------------------------------------------
+    # stop_profile() - Stop recording and return the statistics
+    # ------------------------------------------------------------
+    def stop_profile(self):
+        profile = self.lexprofile
+        self.lexprofile = None
+        self.__dict__.pop('token', None)
+        return profile
+
     # ------------------------------------------------------------
     # skip() - Skip ahead n characters
     # ------------------------------------------------------------
@@ -198,6 +450,9 @@ class Lexer:
     # Note: This function has been carefully implemented to be as fast
     # as possible.  Don't make changes unless you really know what
     # you are doing
+    #
+    # Lines starting with '#@' are only part of the profiled version of
+    # token(), which is made from this source (see _profiled_token()).
     # ------------------------------------------------------------
     def token(self):
         # Make local copies of frequently referenced attributes
@@ -205,37 +460,66 @@ class Lexer:
         lexlen    = self.lexlen
         lexignore = self.lexignore
         lexdata   = self.lexdata
+        lexdispatch = self.lexdispatch
+        lexfixed  = self.lexfixed
+        lexlines  = self.lexlines
+        #@ record = self._profile_record
 
         while lexpos < lexlen:
+            c = lexdata[lexpos]
             # This code provides some short-circuit code for whitespace, tabs, and other ignored characters
-            if lexdata[lexpos] in lexignore:
-                lexpos += 1
+            if c in lexignore:
+                #@ start = lexpos
+                lexpos = self.lexignorere.match(lexdata, lexpos).end()
+                #@ record('ignore', lexpos - start)
                 continue
 
+            # Only try the rules that can start with this character.  Tokens
+            # that are a single fixed character are returned without any regex
+            lexres = lexdispatch.get(c, self.lexre)
+            if lexres.__class__ is str:
+                #@ record(self._profile_fixed_name(lexres), 1)
+                tok = LexToken()
+                tok.value = c
+                tok.lines = lexlines
+                tok.type = lexres
+                tok.lexpos = lexpos
+                self.lexpos = lexpos + 1
+                return tok
+
             # Look for a regular expression match
-            for lexre, lexindexfunc in self.lexre:
+            for lexre, lexindexfunc in lexres:
                 m = lexre.match(lexdata, lexpos)
                 if not m:
                     continue
 
-                # Create a token for return
-                tok = LexToken()
-                tok.value = m.group()
-                tok.lineno = self.lineno
-                tok.lexpos = lexpos
-
                 i = m.lastindex
-                func, tok.type = lexindexfunc[i]
+                func, toktype = lexindexfunc[i]
+                #@ name = self._profile_group_name(lexre, lexindexfunc, i)
 
                 if not func:
+                    #@ record(name, m.end() - lexpos)
                     # If no token type was set, it's an ignored token
-                    if tok.type:
+                    if toktype:
+                        # Tokens that are always the same text share one value string
+                        tok = LexToken()
+                        tok.value = lexfixed.get(toktype) or m.group()
+                        tok.lines = lexlines
+                        tok.type = toktype
+                        tok.lexpos = lexpos
                         self.lexpos = m.end()
                         return tok
                     else:
                         lexpos = m.end()
                         break
 
+                # Create a token for the rule function
+                tok = LexToken()
+                tok.value = m.group()
+                tok.lines = lexlines
+                tok.type = toktype
+                tok.lexpos = lexpos
+
                 lexpos = m.end()
 
                 # If token is processed by a function, call it
@@ -243,7 +527,9 @@ class Lexer:
                 tok.lexer = self      # Set additional attributes useful in token rules
                 self.lexmatch = m
                 self.lexpos = lexpos
+                #@ start = time.perf_counter()
                 newtok = func(tok)
+                #@ record(name, lexpos - tok.lexpos, time.perf_counter() - start)
                 del tok.lexer
                 del self.lexmatch
 
@@ -251,29 +537,35 @@ class Lexer:
                 if not newtok:
                     lexpos    = self.lexpos         # This is here in case user has updated lexpos.
                     lexignore = self.lexignore      # This is here in case there was a state change
+                    lexdispatch = self.lexdispatch
                     break
                 return newtok
             else:
                 # No match, see if in literals
                 if lexdata[lexpos] in self.lexliterals:
+                    #@ record('literals', 1)
                     tok = LexToken()
                     tok.value = lexdata[lexpos]
-                    tok.lineno = self.lineno
+                    tok.lines = lexlines
                     tok.type = tok.value
                     tok.lexpos = lexpos
                     self.lexpos = lexpos + 1
                     return tok
 
-                # No match. Call t_error() if defined.
+                # No match. Call t_error() if defined, with the run of
+                # characters up to where lexing can continue as the value
                 if self.lexerrorf:
+                    end = self._error_run(lexpos)
                     tok = LexToken()
-                    tok.value = self.lexdata[lexpos:]
-                    tok.lineno = self.lineno
+                    tok.value = lexdata[lexpos:end]
+                    tok.lines = lexlines
                     tok.type = 'error'
                     tok.lexer = self
                     tok.lexpos = lexpos
                     self.lexpos = lexpos
+                    #@ start = time.perf_counter()
                     newtok = self.lexerrorf(tok)
+                    #@ record(self.lexerrorf.__name__, self.lexpos - lexpos, time.perf_counter() - start)
                     if lexpos == self.lexpos:
                         # Error method didn't change text position at all. This is an error.
                         raise LexError(f"Scanning error. Illegal character {lexdata[lexpos]!r}",
@@ -291,7 +583,7 @@ class Lexer:
             tok = LexToken()
             tok.type = 'eof'
             tok.value = ''
-            tok.lineno = self.lineno
+            tok.lines = lexlines
             tok.lexpos = lexpos
             tok.lexer = self
             self.lexpos = lexpos
@@ -303,6 +595,42 @@ class Lexer:
             raise RuntimeError('No input string given with input()')
         return None
 
+    # ------------------------------------------------------------
+    # _error_run() - Counts an error at lexpos and returns the end of
+    # the run of characters there that no rule matches
+    # ------------------------------------------------------------
+    def _error_run(self, lexpos):
+        self.lexerrorcount += 1
+        end = _error_run_end(self.lexdata, lexpos, self.lexre, self.lexignore, self.lexliterals)
+        if self.lexmaxerrors is not None and self.lexerrorcount > self.lexmaxerrors:
+            self.lexpos = lexpos
+            raise LexError(f'Too many errors, stopped after {self.lexmaxerrors}', self.lexdata[lexpos:end])
+        return end
+
+    # ------------------------------------------------------------
+    # Profiling helpers, used by the '#@' lines of token().  Rule names
+    # are looked up once per compiled regex or fixed token type.
+    # ------------------------------------------------------------
+    def _profile_record(self, name, length, seconds=0.0):
+        entry = self.lexprofile.get(name)
+        if entry is None:
+            entry = self.lexprofile[name] = [0, 0, 0.0]
+        entry[0] += 1
+        entry[1] += length
+        entry[2] += seconds
+
+    def _profile_fixed_name(self, toktype):
+        names = self.lexprofilenames
+        if toktype not in names:
+            names[toktype] = _fixed_rule_name(self.lexre, toktype)
+        return names[toktype]
+
+    def _profile_group_name(self, lexre, lexindexfunc, i):
+        names = self.lexprofilenames
+        if lexre not in names:
+            names[lexre] = _group_names(lexre, lexindexfunc)
+        return names[lexre][i]
+
     # Iterator interface
     def __iter__(self):
         return self
@@ -313,6 +641,33 @@ class Lexer:
             raise StopIteration
         return t
 
+# -----------------------------------------------------------------------------
+# _profiled_token()
+#
+# Returns token() while profiling, built the first time it's needed from the
+# source of token() with its '#@' lines turned into code.  It makes the same
+# decisions as token() and records them in lexprofile, and there is only one
+# token loop to maintain.  Profiling needs the source of this module.
+# -----------------------------------------------------------------------------
+_token_profiled = None
+
+def _profiled_token():
+    global _token_profiled
+    if _token_profiled is None:
+        import inspect
+        import textwrap
+
+        try:
+            lines, firstlineno = inspect.getsourcelines(Lexer.token)
+        except OSError as e:
+            raise RuntimeError(f'Profiling needs the source of {__file__}') from e
+        source = textwrap.dedent(''.join(re.sub(r'^(\s*)#@ ', r'\1', line) for line in lines))
+        source = source.replace('def token(self):', 'def _token_profiled(self):', 1)
+        namespace = {}
+        exec(compile('\n' * (firstlineno - 1) + source, __file__, 'exec'), globals(), namespace)
+        _token_profiled = namespace['_token_profiled']
+    return _token_profiled
+
 # -----------------------------------------------------------------------------
 #                           ==== Lex Builder ===
 #
@@ -329,6 +684,47 @@ class Lexer:
 def _get_regex(func):
     return getattr(func, 'regex', func.__doc__)
 
+# -----------------------------------------------------------------------------
+# _code_signature()
+#
+# Returns a string that changes whenever what a code object does changes
+# -----------------------------------------------------------------------------
+def _code_signature(co):
+    consts = [_code_signature(c) if isinstance(c, types.CodeType) else repr(c) for c in co.co_consts]
+    return f'{co.co_code.hex()} {consts} {co.co_names}'
+
+# -----------------------------------------------------------------------------
+# _funcs_to_names()
+#
+# Given a list of regular expression functions, this converts it to a list
+# suitable for output to a table file
+# -----------------------------------------------------------------------------
+def _funcs_to_names(funclist, namelist):
+    result = []
+    for f, name in zip(funclist, namelist):
+        if f:
+            result.append((name, f[1]))
+        else:
+            result.append(None)
+    return result
+
+# -----------------------------------------------------------------------------
+# _names_to_funcs()
+#
+# Given a list of regular expression function names, this converts it back to
+# functions.
+# -----------------------------------------------------------------------------
+def _names_to_funcs(namelist, fdict):
+    result = []
+    for n in namelist:
+        if n and n[0] in fdict and callable(fdict[n[0]]):
+            result.append((fdict[n[0]], n[1]))
+        elif n:
+            result.append((None, n[1]))
+        else:
+            result.append(n)
+    return result
+
 # -----------------------------------------------------------------------------
 # get_caller_module_dict()
 #
@@ -377,6 +773,269 @@ def _form_master_re(relist, reflags, ldict, toknames):
         rlist, rre, rnames = _form_master_re(relist[m:], reflags, ldict, toknames)
         return (llist+rlist), (lre+rre), (lnames+rnames)
 
+# -----------------------------------------------------------------------------
+# _ignore_re()
+#
+# Returns a regex that skips a whole run of ignored characters at once
+# -----------------------------------------------------------------------------
+def _ignore_re(ignore):
+    if not ignore:
+        return None
+    return re.compile('[%s]+' % re.escape(ignore))
+
+# -----------------------------------------------------------------------------
+# _error_run_end()
+#
+# Returns the end of the run of illegal characters starting at lexpos: the
+# next position where a character is ignored, a literal starts or a rule
+# matches, which is where stepping over the run a character at a time would
+# stop.  Rules are only tried where their first character allows a match,
+# and those positions are found with a regex search, so the time taken only
+# depends on the length of the run.
+# -----------------------------------------------------------------------------
+_resume_res = {}
+
+def _resume_re(lexre, ignore, literals):
+    key = (tuple(cre for cre, findex in lexre), ignore, literals)
+    if key not in _resume_res:
+        chars = set(ignore) | set(literals)
+        for cre, findex in lexre:
+            first = _first_chars(cre.pattern, cre.flags)
+            if first is None:
+                chars = None
+                break
+            chars |= first
+        if chars is None:
+            _resume_res[key] = None
+        else:
+            # Sets from _first_chars() stand for any non-ASCII characters with _non_ascii
+            ascii = ''.join(re.escape(c) for c in sorted(chars) if c < _non_ascii)
+            _resume_res[key] = re.compile('[%s%s]' % (ascii, '\\x80-\\U0010ffff' if _non_ascii in chars else ''))
+    return _resume_res[key]
+
+def _error_run_end(lexdata, lexpos, lexre, ignore, literals):
+    resume = _resume_re(lexre, ignore, literals)
+    end = len(lexdata)
+    pos = lexpos + 1
+    while pos < end:
+        if resume:
+            m = resume.search(lexdata, pos)
+            if not m:
+                return end
+            pos = m.start()
+        c = lexdata[pos]
+        if c in ignore or c in literals:
+            return pos
+        for cre, findex in lexre:
+            if cre.match(lexdata, pos):
+                return pos
+        pos += 1
+    return end
+
+# -----------------------------------------------------------------------------
+# _fixed_rule_name()
+#
+# Returns the name of the rule for a token that was returned straight from the
+# dispatch table
+# -----------------------------------------------------------------------------
+def _fixed_rule_name(lexres, toktype):
+    for lexre, lexindexfunc in lexres:
+        for f, i in lexre.groupindex.items():
+            if lexindexfunc[i] == (None, toktype):
+                return f
+    return toktype
+
+# -----------------------------------------------------------------------------
+# _group_names()
+#
+# Recovers the rule name of every group of a compiled master regex, in the
+# layout of its lexindexfunc list.
+# -----------------------------------------------------------------------------
+def _group_names(lexre, lexindexfunc):
+    names = [None] * len(lexindexfunc)
+    for f, i in lexre.groupindex.items():
+        names[i] = f
+    return names
+
+# -----------------------------------------------------------------------------
+# _first_chars()
+#
+# Returns the set of ASCII characters that a match of the regular expression
+# can start with, or None if that can't be determined (a rule that might match
+# the empty string, uses lookarounds, backreferences, case folding, ...).  The
+# result may include characters the rule never starts with, but never leaves
+# one out.  Non-ASCII input always goes through the master regex; the set
+# includes _non_ascii in place of any non-ASCII characters a match may start
+# with, so two rules with disjoint sets never match at the same position.
+# -----------------------------------------------------------------------------
+_ascii_chars = [chr(i) for i in range(128)]
+_non_ascii = '\x80'
+
+def _parse_regex(regex, reflags):
+    try:
+        from re import _parser as sre_parse, _constants as sre
+    except ImportError:
+        import sre_parse, sre_constants as sre
+    try:
+        return sre_parse.parse(regex, reflags), sre
+    except Exception:
+        return None, sre
+
+def _first_chars(regex, reflags):
+    if reflags & re.IGNORECASE:
+        return None
+    items, sre = _parse_regex(regex, reflags)
+    if items is None:
+        return None
+
+    categories = {
+        sre.CATEGORY_DIGIT: r'\d', sre.CATEGORY_NOT_DIGIT: r'\D',
+        sre.CATEGORY_SPACE: r'\s', sre.CATEGORY_NOT_SPACE: r'\S',
+        sre.CATEGORY_WORD: r'\w', sre.CATEGORY_NOT_WORD: r'\W',
+    }
+
+    def chars_in(items):
+        chars = set()
+        negate = False
+        for op, av in items:
+            if op is sre.NEGATE:
+                negate = True
+            elif op is sre.LITERAL:
+                chars.add(chr(av))
+            elif op is sre.RANGE:
+                chars.update(map(chr, range(av[0], min(av[1], 127) + 1)))
+                if av[1] > 127:
+                    chars.add(_non_ascii)
+            elif op is sre.CATEGORY and av in categories:
+                catre = re.compile(categories[av])
+                chars.update(c for c in _ascii_chars if catre.match(c))
+                chars.add(_non_ascii)
+            else:
+                return None
+        if negate:
+            chars = (set(_ascii_chars) - chars) | {_non_ascii}
+        return chars
+
+    # Returns (first characters, can match the empty string) for a sequence
+    def seq_first(items):
+        first = set()
+        for op, av in items:
+            if op is sre.AT:
+                continue
+            if op is sre.LITERAL:
+                f, nullable = {chr(av)}, False
+            elif op is sre.NOT_LITERAL:
+                f, nullable = (set(_ascii_chars) | {_non_ascii}) - {chr(av)}, False
+            elif op is sre.ANY:
+                f, nullable = (set(_ascii_chars) | {_non_ascii}) - (set() if reflags & re.DOTALL else {'\n'}), False
+            elif op is sre.IN:
+                f, nullable = chars_in(av), False
+            elif op is sre.SUBPATTERN:
+                if av[1] & re.IGNORECASE:
+                    return None, False
+                f, nullable = seq_first(av[-1])
+            elif op is sre.BRANCH:
+                f, nullable = set(), False
+                for alt in av[1]:
+                    af, anull = seq_first(alt)
+                    if af is None:
+                        return None, False
+                    f |= af
+                    nullable = nullable or anull
+            elif op in (sre.MAX_REPEAT, sre.MIN_REPEAT) or op is getattr(sre, 'POSSESSIVE_REPEAT', None):
+                f, nullable = seq_first(av[2])
+                nullable = nullable or av[0] == 0
+            elif op is getattr(sre, 'ATOMIC_GROUP', None):
+                f, nullable = seq_first(av)
+            else:
+                return None, False
+
+            if f is None:
+                return None, False
+            first |= f
+            if not nullable:
+                return first, False
+        return first, True
+
+    first, nullable = seq_first(items)
+    if nullable:
+        return None
+    if any(c > '\x7f' for c in first):
+        first.add(_non_ascii)
+    return first
+
+# Returns the text matched by a regex that only matches one fixed string
+def _fixed_string(regex, reflags):
+    if reflags & re.IGNORECASE:
+        return None
+    items, sre = _parse_regex(regex, reflags)
+    if not items or any(op is not sre.LITERAL for op, av in items):
+        return None
+    return ''.join(chr(av) for op, av in items)
+
+# -----------------------------------------------------------------------------
+# _order_rules()
+#
+# Reorders a list of (name, regex) rules so the ones matched most often in a
+# profile (rule name -> match count, or the statistics recorded by
+# Lexer.start_profile()) come first.  Python's re takes the first alternative
+# that matches, so two rules that might match at the same position, because
+# their first characters overlap, keep their relative order.
+# -----------------------------------------------------------------------------
+def _profile_count(entry):
+    if isinstance(entry, (list, tuple)):
+        return entry[0]
+    return entry or 0
+
+def _order_rules(rules, profile, reflags):
+    counts = [_profile_count(profile.get(name)) for name, regex in rules]
+    firsts = [_first_chars(regex, reflags) for name, regex in rules]
+
+    def overlaps(i, j):
+        return firsts[i] is None or firsts[j] is None or not firsts[i].isdisjoint(firsts[j])
+
+    pending = list(range(len(rules)))
+    ordered = []
+    while pending:
+        # Rules that no earlier pending rule has to stay ahead of.  Ties keep
+        # the original order.
+        ready = [j for k, j in enumerate(pending) if not any(overlaps(i, j) for i in pending[:k])]
+        best = max(ready, key=lambda j: counts[j])
+        pending.remove(best)
+        ordered.append(rules[best])
+    return ordered
+
+# -----------------------------------------------------------------------------
+# _form_dispatch()
+#
+# Builds the first character dispatch table used by Lexer.token().  For every
+# ASCII character, only the rules that can start with it are combined into a
+# smaller master regex, keeping their original order so that the same rule
+# wins as in the full master regex.  A character that can only start a single
+# fixed one-character string rule maps straight to its token name.
+# -----------------------------------------------------------------------------
+def _form_dispatch(rules, reflags, ldict, toknames):
+    firsts = [_first_chars(regex, reflags) for name, regex in rules]
+    dispatch = {}
+    shared = {}
+    for c in _ascii_chars:
+        candidates = tuple(i for i, first in enumerate(firsts) if first is None or c in first)
+        if not candidates or len(candidates) == len(rules):
+            continue
+
+        if len(candidates) == 1:
+            name, regex = rules[candidates[0]]
+            if (isinstance(ldict.get(name), StringTypes) and toknames[name].find('ignore_') < 0
+                    and _fixed_string(regex, reflags) == c):
+                dispatch[c] = toknames[name]
+                continue
+
+        if candidates not in shared:
+            relist = ['(?P<%s>%s)' % rules[i] for i in candidates]
+            shared[candidates] = _form_master_re(relist, reflags, ldict, toknames)[0]
+        dispatch[c] = shared[candidates]
+    return dispatch
+
 # -----------------------------------------------------------------------------
 # def _statetoken(s,names)
 #
@@ -434,6 +1093,29 @@ class LexerReflect(object):
         self.validate_rules()
         return self.error
 
+    # Compute a hash of everything the lexer tables are built from.  Tables
+    # written in optimized mode are only reused while this stays the same.
+    # With code=True, the bytecode of the rule functions is included too, for
+    # anything generated from what the functions do.
+    def signature(self, code=False, profile=None):
+        parts = [repr(self.tokens), repr(self.literals), repr(self.stateinfo), repr(int(self.reflags))]
+        if profile:
+            parts.append(repr(sorted((name, _profile_count(entry)) for name, entry in profile.items())))
+        for state in self.stateinfo:
+            for fname, f in self.funcsym.get(state, []):
+                parts.append(f'{state} {fname} {_get_regex(f)}')
+                if code:
+                    parts.append(_code_signature(f.__code__))
+            for name, r in self.strsym.get(state, []):
+                parts.append(f'{state} {name} {r}')
+            parts.append(f'{state} ignore {self.ignore.get(state)!r}')
+            for tab in (self.errorf, self.eoff):
+                f = tab.get(state)
+                parts.append(f'{state} {f.__name__ if f else None}')
+                if code and f:
+                    parts.append(_code_signature(f.__code__))
+        return hashlib.sha256('\n'.join(parts).encode('utf-8')).hexdigest()
+
     # Get the tokens map
     def get_tokens(self):
         tokens = self.ldict.get('tokens', None)
@@ -581,6 +1263,8 @@ class LexerReflect(object):
 
     # Validate all of the t_rules collected
     def validate_rules(self):
+        import inspect
+
         for state in self.stateinfo:
             # Validate all rules defined by functions
 
@@ -684,6 +1368,8 @@ class LexerReflect(object):
     # -----------------------------------------------------------------------------
 
     def validate_module(self, module):
+        import inspect
+
         try:
             lines, linen = inspect.getsourcelines(module)
         except IOError:
@@ -714,8 +1400,8 @@ class LexerReflect(object):
 #
 # Build all of the regular expression rules from definitions in the supplied module
 # -----------------------------------------------------------------------------
-def lex(*, module=None, object=None, debug=False, 
-        reflags=int(re.VERBOSE), debuglog=None, errorlog=None):
+def lex(*, module=None, object=None, debug=False, optimize=False, lextab='lextab',
+        reflags=int(re.VERBOSE), outputdir=None, debuglog=None, errorlog=None, profile=None):
 
     global lexer
 
@@ -748,6 +1434,21 @@ def lex(*, module=None, object=None, debug=False,
     # Collect parser information from the dictionary
     linfo = LexerReflect(ldict, log=errorlog, reflags=reflags)
     linfo.get_all()
+
+    # In optimized mode, reuse the tables written by a previous run as long
+    # as the rules they were built from haven't changed
+    signature = None
+    if optimize and lextab:
+        signature = linfo.signature(profile=profile)
+        try:
+            lexobj.readtab(lextab, ldict, signature)
+            token = lexobj.token
+            input = lexobj.input
+            lexer = lexobj
+            return lexobj
+        except (ImportError, SyntaxError, AttributeError, KeyError):
+            pass
+
     if linfo.validate_all():
         raise SyntaxError("Can't build lexer")
 
@@ -774,23 +1475,31 @@ def lex(*, module=None, object=None, debug=False,
     stateinfo = linfo.stateinfo
 
     regexs = {}
+    rules = {}
     # Build the master regular expressions
     for state in stateinfo:
-        regex_list = []
+        rules[state] = []
 
         # Add rules defined by functions first
         for fname, f in linfo.funcsym[state]:
-            regex_list.append('(?P<%s>%s)' % (fname, _get_regex(f)))
+            rules[state].append((fname, _get_regex(f)))
             if debug:
                 debuglog.info("lex: Adding rule %s -> '%s' (state '%s')", fname, _get_regex(f), state)
 
         # Now add all of the simple rules
         for name, r in linfo.strsym[state]:
-            regex_list.append('(?P<%s>%s)' % (name, r))
+            rules[state].append((name, r))
             if debug:
                 debuglog.info("lex: Adding rule %s -> '%s' (state '%s')", name, r, state)
 
-        regexs[state] = regex_list
+        # Try the most frequently matched rules first, where that can't
+        # change which rule matches
+        if profile:
+            rules[state] = _order_rules(rules[state], profile, reflags)
+            if debug:
+                debuglog.info('lex: Rule order (state %r) = %r', state, [name for name, r in rules[state]])
+
+        regexs[state] = ['(?P<%s>%s)' % rule for rule in rules[state]]
 
     # Build the master regular expressions
 
@@ -812,15 +1521,35 @@ def lex(*, module=None, object=None, debug=False,
             lexobj.lexstatere[state].extend(lexobj.lexstatere['INITIAL'])
             lexobj.lexstateretext[state].extend(lexobj.lexstateretext['INITIAL'])
             lexobj.lexstaterenames[state].extend(lexobj.lexstaterenames['INITIAL'])
+            rules[state] = rules[state] + rules['INITIAL']
+
+    # Build the first character dispatch tables
+    for state in stateinfo:
+        lexobj.lexstatedispatch[state] = _form_dispatch(rules[state], reflags, ldict, linfo.toknames)
+
+    # Find the tokens that always match the same text, so they can share it
+    fixed = {}
+    for state in stateinfo:
+        for name, r in linfo.strsym[state]:
+            tokname = linfo.toknames[name]
+            if tokname.find('ignore_') < 0:
+                fixed.setdefault(tokname, set()).add(_fixed_string(r, reflags))
+    for funcs in linfo.funcsym.values():
+        for fname, f in funcs:
+            fixed.pop(linfo.toknames[fname], None)
+    lexobj.lexfixed = {tokname: texts.pop() for tokname, texts in fixed.items()
+                       if len(texts) == 1 and None not in texts}
 
     lexobj.lexstateinfo = stateinfo
     lexobj.lexre = lexobj.lexstatere['INITIAL']
     lexobj.lexretext = lexobj.lexstateretext['INITIAL']
+    lexobj.lexdispatch = lexobj.lexstatedispatch['INITIAL']
     lexobj.lexreflags = reflags
 
     # Set up ignore variables
     lexobj.lexstateignore = linfo.ignore
     lexobj.lexignore = lexobj.lexstateignore.get('INITIAL', '')
+    lexobj.lexignorere = _ignore_re(lexobj.lexignore)
 
     # Set up error functions
     lexobj.lexstateerrorf = linfo.errorf
@@ -850,8 +1579,52 @@ def lex(*, module=None, object=None, debug=False,
     input = lexobj.input
     lexer = lexobj
 
+    # If in optimize mode, we write the lextab
+    if lextab and optimize:
+        if outputdir is None:
+            # If no output directory is set, the location of the output files
+            # is determined according to the following rules:
+            #     - If lextab specifies a package, files go into that package directory
+            #     - Otherwise, files go in the same directory as the specifying module
+            if '.' not in lextab:
+                srcfile = ldict['__file__']
+            else:
+                pkgname = lextab.rsplit('.', 1)[0]
+                srcfile = getattr(importlib.import_module(pkgname), '__file__', '')
+            outputdir = os.path.dirname(srcfile)
+        try:
+            lexobj.writetab(lextab, outputdir, signature)
+            sys.modules.pop(lextab, None)
+        except IOError as e:
+            errorlog.warning("Couldn't write lextab module %r. %s" % (lextab, e))
+
     return lexobj
 
+# -----------------------------------------------------------------------------
+# lex_signature(module)
+#
+# Returns the signature of the rules in the supplied module without building
+# or validating a lexer
+# -----------------------------------------------------------------------------
+def lex_signature(*, module, reflags=int(re.VERBOSE), code=False, profile=None):
+    ldict = {k: getattr(module, k) for k in dir(module)}
+    linfo = LexerReflect(ldict, reflags=reflags)
+    linfo.get_all()
+    return linfo.signature(code, profile)
+
+# -----------------------------------------------------------------------------
+# profile_report()
+#
+# Writes the statistics recorded by Lexer.start_profile() as a table, the
+# most frequently matched rules first
+# -----------------------------------------------------------------------------
+def profile_report(profile, out=None):
+    out = out or sys.stdout
+    total = sum(entry[0] for entry in profile.values()) or 1
+    out.write(f"{'rule':<24} {'matches':>10} {'%':>6} {'chars':>10} {'func time':>10}\n")
+    for name, (count, length, seconds) in sorted(profile.items(), key=lambda item: -item[1][0]):
+        out.write(f'{name:<24} {count:>10} {100 * count / total:>6.2f} {length:>10} {seconds:>9.3f}s\n')
+
 # -----------------------------------------------------------------------------
 # runmain()
 #
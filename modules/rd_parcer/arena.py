@@ -0,0 +1,225 @@
+import sys
+from array import array
+from typing import Iterable
+from modules.lexer_rules import tokens as _tokenTypes, kinds as _kinds
+from modules.ply_lex import LexToken
+from modules.rd_parcer import schema
+from modules.rd_parcer.visitor import children, postorder
+import modules.rd_parcer.expressions as Expr
+import modules.rd_parcer.statements as Stmt
+
+# Statements kept in parallel typed arrays instead of one object per node.
+# Node i has kind kinds[i] (a node class), up to three children or other
+# fields in a[i], b[i] and c[i], and spans the source from starts[i] to
+# ends[i]. Nodes with a list of children keep it in extra[a[i]:a[i] + b[i]].
+# Spans cover the tokens that trees keep: names, operators and the braces
+# of blocks that have a span. Literals keep no token, so a node made up of
+# literals only has no span (-1).
+# Instead of the tokens they were parsed from, nodes keep the index of the
+# token's (type, text) in names, or of a literal's value in constants; each
+# of these is stored once. A tree only holds on to its arrays, so none of
+# the tokens are kept alive.
+#
+# node(i) returns a view of node i: an instance of a subclass of its node
+# class, whose fields are read from the arrays when asked for. Tokens read
+# from a view have a type, value and position but no line index.
+
+# Child, or None
+_NONE = -1
+
+# Fields of each node class, from schema.fields: those holding a child node
+# (stored in a, b and c), the one holding a list of them or of tokens
+# (stored in extra) and the one holding a token. The order is that of the
+# kind codes.
+def _layout(fields: tuple) -> tuple:
+    nodes = tuple(name for name, kind in fields if kind == schema.NODE)
+    items = next((name for name, kind in fields if kind in (schema.NODES, schema.TOKENS)), None)
+    token = next((name for name, kind in fields if kind == schema.TOKEN), None)
+    return nodes, items, token
+
+_layouts = {cls: _layout(fields) for cls, fields in schema.fields.items()}
+_kindOf = {cls: kind for kind, cls in enumerate(_layouts)}
+
+# A node's token is at its start, except for the operators of binary
+# nodes, whose position is kept in c. Var keeps the kind code of its type
+# in b.
+_operatorAt = {_kindOf[Expr.Binary], _kindOf[Expr.Logical]}
+_VAR = _kindOf[Stmt.Var]
+_CIN = _kindOf[Stmt.Cin]
+_LITERAL = _kindOf[Expr.Literal]
+_BLOCK = _kindOf[Stmt.Block]
+
+class Arena:
+    def __init__(self, statements: Iterable[Stmt.Stmt] = ()):
+        self.kinds = array('B')
+        self.a = array('i')
+        self.b = array('i')
+        self.c = array('q')
+        self.starts = array('q')
+        self.ends = array('q')
+        # Index in names or constants
+        self.values = array('i')
+        self.extra = array('i')
+        self.names: list[tuple[str, str]] = []
+        self.constants: list = []
+        self._nameIds: dict = {}
+        self._constantIds: dict = {}
+        # Top-level statements
+        self.roots = array('i')
+        self.extend(statements)
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    # Adds top-level statements, such as those yielded by
+    # RDParser.iter_parse(), whose trees can be dropped once they're added
+    def extend(self, statements: Iterable[Stmt.Stmt]):
+        for statement in statements:
+            self.roots.append(self.add(statement))
+
+    # The views of the top-level statements
+    def statements(self) -> list[Stmt.Stmt]:
+        return [self.node(i) for i in self.roots]
+
+    def node(self, i: int):
+        if (i == _NONE): return None
+        return _views[self.kinds[i]](self, i)
+
+    # Adds the tree of node and returns the index of its root. Children are
+    # added before their parents, in visitor.postorder(), so that nesting
+    # depth isn't limited by the Python stack.
+    def add(self, node) -> int:
+        done: list[int] = []
+        for node in postorder(node, missing=True):
+            if (node is None):
+                done.append(_NONE)
+                continue
+            # The variables of cin are stored as Identifier nodes
+            if (type(node) is Stmt.Cin):
+                nodes = [self._addNode(Expr.Identifier(v), []) for v in node.variables]
+            else:
+                count = len(children(node, missing=True))
+                nodes = done[len(done) - count:]
+                del done[len(done) - count:]
+            done.append(self._addNode(node, nodes))
+        return done[0]
+
+    def _addNode(self, node, children: list[int]) -> int:
+        kind = _kindOf[type(node)]
+        fields, items, tokenField = _layouts[type(node)]
+        starts, ends = self.starts, self.ends
+
+        start = end = _NONE
+        for child in children:
+            if (child == _NONE or starts[child] == _NONE): continue
+            if (start == _NONE or starts[child] < start): start = starts[child]
+            if (ends[child] > end): end = ends[child]
+
+        value = _NONE
+        c = _NONE
+        if (tokenField is not None):
+            token = getattr(node, tokenField)
+            name = (token.type, token.value)
+            value = self._intern(self.names, self._nameIds, name, name)
+            tokenEnd = token.lexpos + len(token.value)
+            if (start == _NONE or token.lexpos < start): start = token.lexpos
+            if (tokenEnd > end): end = tokenEnd
+            if (kind in _operatorAt): c = token.lexpos
+        elif (kind == _LITERAL):
+            value = self._intern(self.constants, self._constantIds, (type(node.value), node.value), node.value)
+        elif (kind == _BLOCK and node.span):
+            start, end = node.span[0].lexpos, node.span[1].lexpos + 1
+
+        if (items is not None):
+            a, b = len(self.extra), len(children)
+            self.extra.extend(children)
+        else:
+            a, b = (children + [_NONE, _NONE])[:2]
+            if (len(children) == 3): c = children[2]
+        if (kind == _VAR): b = _kinds[node.type]
+
+        self.kinds.append(kind)
+        self.a.append(a)
+        self.b.append(b)
+        self.c.append(c)
+        starts.append(start)
+        ends.append(end)
+        self.values.append(value)
+        return len(self.kinds) - 1
+
+    # Index of value in table, which holds each one once. Keys tell apart
+    # values that compare equal, like 1, 1.0 and True.
+    def _intern(self, table: list, ids: dict, key, value) -> int:
+        i = ids.get(key)
+        if (i is None):
+            i = ids[key] = len(table)
+            table.append(value)
+        return i
+
+
+## Views
+
+def _token(arena: Arena, i: int) -> LexToken:
+    token = LexToken()
+    token.type, token.value = arena.names[arena.values[i]]
+    token.lexpos = arena.c[i] if (arena.kinds[i] in _operatorAt) else arena.starts[i]
+    return token
+
+def _viewInit(self, arena: Arena, index: int):
+    self.arena = arena
+    self.index = index
+
+def _childField(column: str) -> property:
+    return property(lambda self: self.arena.node(getattr(self.arena, column)[self.index]))
+
+def _itemsField(kind: int) -> property:
+    def get(self):
+        arena, i = self.arena, self.index
+        nodes = [arena.node(child) for child in arena.extra[arena.a[i]:arena.a[i] + arena.b[i]]]
+        return [node.name for node in nodes] if (kind == _CIN) else nodes
+    return property(get)
+
+def _viewClass(cls, kind: int) -> type:
+    fields, items, tokenField = _layouts[cls]
+    namespace = {'__slots__': ('arena', 'index'), '__init__': _viewInit}
+    for column, field in zip(('a', 'b', 'c'), fields):
+        namespace[field] = _childField(column)
+    if (items is not None):
+        namespace[items] = _itemsField(kind)
+    if (tokenField is not None):
+        namespace[tokenField] = property(lambda self: _token(self.arena, self.index))
+    if (cls is Expr.Literal):
+        namespace['value'] = property(lambda self: self.arena.constants[self.arena.values[self.index]])
+    if (cls is Stmt.Var):
+        namespace['type'] = property(lambda self: _tokenTypes[self.arena.b[self.index]])
+    # Views can't be reparsed, so blocks have no span
+    if (cls is Stmt.Block):
+        namespace['span'] = namespace['starts'] = property(lambda self: None)
+    return type(cls.__name__, (cls,), namespace)
+
+_views = [_viewClass(cls, kind) for cls, kind in _kindOf.items()]
+
+
+# Memory report: parses a file and compares the memory taken by its
+# statements as objects and in an arena
+if __name__ == '__main__':
+    import gc
+    import tracemalloc
+    from modules import scanner
+    from modules.rd_parcer.parser import RDParser
+
+    with open(sys.argv[1]) as file:
+        tokens = scanner.tokenize_all(file.read())
+    gc.disable()
+
+    tracemalloc.start()
+    statements = RDParser(tokens).parse()
+    objects = tracemalloc.get_traced_memory()[0]
+    arena = Arena(statements)
+    del statements
+    arenaSize = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    print(f'{len(arena)} nodes, {len(arena.names)} names, {len(arena.constants)} constants')
+    print(f'objects: {objects / 2**20:.1f} MiB, {objects / len(arena):.0f} bytes per node (with their tokens)')
+    print(f'arena:   {arenaSize / 2**20:.1f} MiB, {arenaSize / len(arena):.0f} bytes per node')
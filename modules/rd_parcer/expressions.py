@@ -1,37 +1,47 @@
 from modules.ply_lex import LexToken
 
 
-class Expr: ...
+# Nodes declare __slots__, so each one takes no more memory than its fields.
+# arena.Arena keeps whole trees in arrays instead.
+class Expr:
+    __slots__ = ()
 
 class Assign(Expr):
+     __slots__ = ('name', 'value')
      def __init__(self, name: LexToken, value:Expr):
           self.name = name
           self.value = value
 
 class Binary(Expr):
+        __slots__ = ('left', 'operator', 'right')
         def __init__(self, leftExpr:Expr, operatorToken:LexToken, rightExpr: Expr):
             self.left = leftExpr
             self.operator = operatorToken
             self.right = rightExpr
 
 class Unary(Expr):
+    __slots__ = ('operator', 'expression')
     def __init__(self, operator: LexToken, expr: Expr):
         self.operator = operator
         self.expression = expr
 
 class Literal(Expr):
+    __slots__ = ('value',)
     def __init__(self, value:any):
         self.value = value
 
 class Grouping(Expr):
+    __slots__ = ('expression',)
     def __init__(self, expr:Expr):
         self.expression = expr
 
 class Identifier(Expr):
+     __slots__ = ('name',)
      def __init__(self, name: LexToken):
           self.name = name
 
 class Logical(Expr):
+     __slots__ = ('left', 'operator', 'right')
      def __init__(self, left: Expr, operator: LexToken, right:Expr):
           self.left = left
           self.operator = operator
@@ -0,0 +1,239 @@
+import json
+import struct
+import sys
+from array import array
+from typing import BinaryIO, Iterable, Iterator, TextIO
+from modules.ply_lex import LexToken
+from modules.rd_parcer import schema
+from modules.rd_parcer.schema import NODE, NODES, TOKEN, TOKENS
+from modules.rd_parcer.visitor import Visitor, flatten, postorder
+import modules.rd_parcer.expressions as Expr
+import modules.rd_parcer.statements as Stmt
+
+# Machine-readable forms of the statements: JSON lines, and a compact
+# binary format with a loader that rebuilds the trees. Both follow the
+# fields in schema.fields and walk the trees with the helpers of visitor,
+# so nesting depth doesn't matter.
+
+
+## JSON lines
+# Each top-level statement is written on its own line as it comes. Nodes
+# are objects with a "node" member naming their class, then their fields.
+# Tokens are given by their value, missing nodes by null.
+
+def writeJson(statements: Iterable[Stmt.Stmt], file: TextIO = None):
+    write = (file or sys.stdout).write
+    visit = _json.visit
+    for statement in statements:
+        write(''.join(flatten([statement], visit)))
+        write('\n')
+
+class _Json(Visitor):
+    def visitNone(self, node) -> list:
+        return ['null']
+
+    def generic(self, node):
+        cls = schema.nodeClass(type(node))
+        yield f'{{"node": "{cls.__name__}"'
+        for name, kind in schema.fields[cls]:
+            value = getattr(node, name)
+            yield f', "{name}": '
+            if (kind == NODE):
+                yield value
+            elif (kind == NODES):
+                yield '['
+                for i, child in enumerate(value):
+                    if (i): yield ', '
+                    yield child
+                yield ']'
+            elif (kind == TOKEN):
+                yield json.dumps(value.value)
+            elif (kind == TOKENS):
+                yield json.dumps([token.value for token in value])
+            else:
+                yield json.dumps(value)
+        yield '}'
+
+_json = _Json()
+
+
+## Binary
+# The file starts with _MAGIC, followed by one record per top-level
+# statement. A record is the length of the rest of it (4 bytes), then:
+#   the entries it adds to the table of tokens and values: a count, and
+#     for each a kind byte and the length and UTF-8 text of its data;
+#   the nodes in post-order: a count and one tag byte each (a node class
+#     code, or _NONE_TAG for a missing node);
+#   their operands in the same order, for each node the fields that aren't
+#     child nodes: table indexes, and the lengths of lists. A width byte
+#     (2 or 4) says how many bytes each takes, then come a count and the
+#     operands.
+# All integers are little-endian and unsigned; counts and lengths take 4
+# bytes. The table is shared by all the records of a file, so they're read
+# in order. Tokens don't keep their positions.
+
+_MAGIC = b'NOTCAST\x01'
+_NONE_TAG = 255
+_classes = list(schema.fields)
+_tagOf = {cls: tag for tag, cls in enumerate(_classes)}
+
+_u32 = struct.Struct('<I')
+
+def writeBinary(statements: Iterable[Stmt.Stmt], file: BinaryIO = None):
+    file = file or sys.stdout.buffer
+    file.write(_MAGIC)
+    ids: dict = {}
+    for statement in statements:
+        file.write(_encode(statement, ids))
+
+# Key and entry of a value in the table. Values that compare equal but
+# differ in type, like 1, 1.0 and True, get their own.
+def _entry(value) -> tuple:
+    if (isinstance(value, LexToken)): return (b'T', value.type, value.value), f'{value.type}\0{value.value}'
+    if (type(value) is bool): return (b'B', value), '1' if value else '0'
+    if (type(value) is int): return (b'I', value), str(value)
+    if (type(value) is float): return (b'F', value), repr(value)
+    return (b'S', value), value
+
+def _encode(node, ids: dict) -> bytes:
+    entries = []
+    def index(value) -> int:
+        key, text = _entry(value)
+        i = ids.get(key)
+        if (i is None):
+            i = ids[key] = len(ids)
+            data = text.encode('utf-8', 'surrogatepass')
+            entries.append(key[0] + _u32.pack(len(data)) + data)
+        return i
+
+    tags = bytearray()
+    operands = []
+    for node in postorder(node, missing=True):
+        if (node is None):
+            tags.append(_NONE_TAG)
+            continue
+        cls = schema.nodeClass(type(node))
+        tags.append(_tagOf[cls])
+        for name, kind in schema.fields[cls]:
+            if (kind == NODE): continue
+            value = getattr(node, name)
+            if (kind == NODES):
+                operands.append(len(value))
+            elif (kind == TOKENS):
+                operands.append(len(value))
+                operands += map(index, value)
+            else:
+                operands.append(index(value))
+
+    width = 'H' if (max(operands, default=0) < 1 << 16) else 'I'
+    packed = array(width, operands)
+    if (sys.byteorder == 'big'): packed.byteswap()
+    record = b''.join([
+        _u32.pack(len(entries)), *entries,
+        _u32.pack(len(tags)), tags,
+        bytes([packed.itemsize]), _u32.pack(len(packed)), packed.tobytes(),
+    ])
+    return _u32.pack(len(record)) + record
+
+# Reads a file written by writeBinary() and yields its statements. Equal
+# tokens, identifiers and literals come back as one shared object.
+def readBinary(file: BinaryIO) -> Iterator[Stmt.Stmt]:
+    if (file.read(len(_MAGIC)) != _MAGIC):
+        raise ValueError('not a binary notc file')
+    table = _Table()
+    while True:
+        size = file.read(4)
+        if (not size): return
+        yield _decode(file.read(_u32.unpack(size)[0]), table)
+
+class _Table:
+    # Entries of the file's table, and the shared leaves made from them
+    def __init__(self):
+        self.values: list = []
+        self.identifiers: dict = {}
+        self.literals: dict = {}
+
+    def identifier(self, i: int) -> Expr.Identifier:
+        node = self.identifiers.get(i)
+        if (node is None): node = self.identifiers[i] = Expr.Identifier(self.values[i])
+        return node
+
+    def literal(self, i: int) -> Expr.Literal:
+        node = self.literals.get(i)
+        if (node is None): node = self.literals[i] = Expr.Literal(self.values[i])
+        return node
+
+def _value(kind: bytes, text: str):
+    if (kind == b'T'):
+        token = LexToken()
+        token.type, token.value = text.split('\0', 1)
+        return token
+    if (kind == b'B'): return text == '1'
+    if (kind == b'I'): return int(text)
+    if (kind == b'F'): return float(text)
+    return text
+
+def _decode(record: bytes, table: _Table) -> Stmt.Stmt:
+    values = table.values
+    (count,) = _u32.unpack_from(record, 0)
+    at = 4
+    for _ in range(count):
+        (size,) = _u32.unpack_from(record, at + 1)
+        values.append(_value(record[at:at + 1], record[at + 5:at + 5 + size].decode('utf-8', 'surrogatepass')))
+        at += 5 + size
+
+    (count,) = _u32.unpack_from(record, at)
+    tags = record[at + 4:at + 4 + count]
+    at += 4 + count
+    width = 'H' if (record[at] == 2) else 'I'
+    (count,) = _u32.unpack_from(record, at + 1)
+    operands = array(width, record[at + 5:at + 5 + count * record[at]])
+    if (sys.byteorder == 'big'): operands.byteswap()
+
+    operand = iter(operands).__next__
+    stack = []
+    push = stack.append
+    for tag in tags:
+        if (tag == _IDENTIFIER_TAG):
+            push(table.identifier(operand()))
+        elif (tag == _LITERAL_TAG):
+            push(table.literal(operand()))
+        elif (tag == _NONE_TAG):
+            push(None)
+        else:
+            push(_build(_classes[tag], stack, operand, values))
+    return stack[0]
+
+_IDENTIFIER_TAG = _tagOf[Expr.Identifier]
+_LITERAL_TAG = _tagOf[Expr.Literal]
+
+# Makes a node of class cls from its operands and the children on top of
+# the stack
+def _build(cls: type, stack: list, operand, values: list):
+    layout = schema.fields[cls]
+    args = []
+    children = 0
+    for name, kind in layout:
+        if (kind == NODE):
+            args.append(None)
+            children += 1
+        elif (kind == NODES):
+            count = operand()
+            args.append(count)
+            children += count
+        elif (kind == TOKENS):
+            args.append([values[operand()] for _ in range(operand())])
+        else:
+            args.append(values[operand()])
+
+    at = len(stack) - children
+    for i, (name, kind) in enumerate(layout):
+        if (kind == NODE):
+            args[i] = stack[at]
+            at += 1
+        elif (kind == NODES):
+            count = args[i]
+            args[i] = stack[at:at + count]
+            at += count
+    del stack[len(stack) - children:]
+    return cls(*args)
@@ -1,4 +1,7 @@
-from modules.lexer_rules import Token
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Iterable, Iterator
+from modules.lexer_rules import Kind, kinds as _kinds
 from modules.ply_lex import LexToken
 from modules import state
 import modules.rd_parcer.expressions as Expr
@@ -57,39 +60,313 @@ import modules.rd_parcer.statements as Stmt
 #                | "(" expression ")"
 #                | IDENTIFIER ;
 
-_variableTypes = [
-    Token.BOOL,
-    Token.CHAR,
-    Token.DOUBLE,
-    Token.FLOAT,
-    Token.INT,
-    Token.SHORT
-]
+_variableKinds = {
+    Kind.BOOL,
+    Kind.CHAR,
+    Kind.DOUBLE,
+    Kind.FLOAT,
+    Kind.INT,
+    Kind.SHORT
+}
+
+# Binary operator kind -> (binding power, node class). Higher powers bind
+# tighter; these follow the grammar levels from logic_or to factor.
+_infixRules = {
+    Kind.BAR_BAR: (1, Expr.Logical),
+    Kind.AMP_AMP: (2, Expr.Logical),
+    Kind.BANG_EQUAL: (3, Expr.Binary),
+    Kind.EQUAL_EQUAL: (3, Expr.Binary),
+    Kind.GREATER: (4, Expr.Binary),
+    Kind.GREATER_EQUAL: (4, Expr.Binary),
+    Kind.LESS: (4, Expr.Binary),
+    Kind.LESS_EQUAL: (4, Expr.Binary),
+    Kind.MINUS: (5, Expr.Binary),
+    Kind.PLUS: (5, Expr.Binary),
+    Kind.SLASH: (6, Expr.Binary),
+    Kind.STAR: (6, Expr.Binary),
+    Kind.PERCENT: (6, Expr.Binary),
+}
+
+_prefixKinds = {Kind.BANG, Kind.MINUS}
+
+# Powers of the operator stack entries in RDParser.expression(): prefix
+# operators bind tightest, and '(' waits for its ')'
+_UNARY_POWER = 7
+_GROUP = (-1, None, None)
+
+_literalKinds = {Kind.NUMBER, Kind.DECIMAL, Kind.STRING, Kind.ENDL}
+
+# Tokens that end a statement or the head of a compound one, and the tokens
+# after those that still belong to the enclosing statements
+_endKinds = {Kind.SEMICOLON, Kind.LEFT_BRACE, Kind.RIGHT_BRACE}
+_closeKinds = {Kind.RIGHT_BRACE, Kind.ELSE}
+
+# Kinds that start a declaration, after which _synchronize() stops skipping
+_synchronizeKinds = {
+    Kind.BOOL, Kind.CHAR, Kind.CIN, Kind.COUT, Kind.DOUBLE, Kind.ELSE, Kind.ENDL, Kind.FALSE,
+    Kind.FLOAT, Kind.FOR, Kind.IF, Kind.INT, Kind.SHORT, Kind.TRUE, Kind.WHILE
+}
 
 class RDParser:
-    def __init__(self,tokens:list[LexToken]):
+    # tokens may be a list of LexToken or a scanner.TokenTable, which
+    # already carries its kind codes. Syntax errors are added to
+    # diagnostics, which is usually the one the tokens were lexed with, so
+    # that both kinds of errors are kept in the order they were found.
+    #
+    # Literals are immutable, so equal ones share one node. Identifiers
+    # keep the token they were parsed from; without locations, equal ones
+    # share one node too, which has the token of the first of them.
+    def __init__(self,tokens:list[LexToken] = (), diagnostics: state.Diagnostics = None, locations: bool = True):
         self.tokens: list[LexToken] = tokens
+        self.diagnostics: state.Diagnostics = diagnostics or state.Diagnostics()
+        self.locations = locations
+        self._literals: dict = {}
+        self._identifiers: dict[str, Expr.Identifier] = {}
+        self.kinds: array = getattr(tokens, 'kinds', None)
+        if (self.kinds is None):
+            self.kinds = array('B', [_kinds[t.type] for t in tokens])
         self.current: int = 0
+        # Blocks and top-level statements record the tokens they start and
+        # end with, for reparse(). The tokens of a scanner.TokenTable are
+        # made when asked for, so they have no identity to keep.
+        self.spans: bool = isinstance(tokens, list)
+        # Top-level statements of parse(), and the token each one starts at
+        self.statements: list[Stmt.Stmt] = None
+        self.starts: list[LexToken] = None
+        # Tokens still to be read by iter_parse(), and the index up to which
+        # they've been buffered for the statement being parsed
+        self._source: Iterator[LexToken] = None
+        self._filled: int = len(self.kinds)
 
     
     def parse(self) -> list[Stmt.Stmt]:
         statements: list[Stmt.Stmt] = []
+        starts: list[LexToken] = []
 
         while (not self.isAtEnd()):
+            if (self.spans): starts.append(self.peek())
             statements.append(self.declaration())
         
+        # Kept for reparse()
+        self.statements = statements
+        self.starts = starts
         return statements
 
+    # Updates the statements from parse() after scanner.relex() replaced some
+    # of the tokens, which are now tokens[first:last]. Only the statements
+    # of the innermost block around the edit (or the top level) are parsed
+    # again: from the one that holds the token before the edit, which may
+    # have looked at the next token, to the first statement after the edit
+    # that still starts where it did. The rest are kept as they are, and
+    # the lists of the block are updated in place. If the edit moves the end
+    # of the block, the statement holding the block is parsed again instead.
+    # Returns the same list as parse().
+    def reparse(self, first: int, last: int) -> list[Stmt.Stmt]:
+        tokens = self.tokens
+        removed = len(self.kinds) - len(tokens) + (last - first)
+        self.kinds[first:first + removed] = array('B', [_kinds[t.type] for t in tokens[first:last]])
+
+        # Index of a token, where tokens that were replaced sort with the new
+        # ones
+        def position(token: LexToken) -> int:
+            i = self._indexOf(token)
+            return first if (i < 0) else i
+
+        # Blocks from the top level in, with the statement holding the next
+        path = []
+        statements, starts, block = self.statements, self.starts, None
+        while True:
+            i = max(bisect_right(starts, first - 1, key=position) - 1, 0)
+            k = bisect_left(starts, last, key=position)
+            if (i < len(starts) and position(starts[i]) < first):
+                begin = position(starts[i])
+            else:
+                begin = self._indexOf(block.span[0]) + 1 if block else 0
+
+            inner = self._blockAround(statements[i], first, last) if (k == i + 1 and begin < first) else None
+            if (inner is None): break
+            path.append((statements, starts, block, i))
+            statements, starts, block = inner.statements, inner.starts, inner
+
+        while (not self._reparseRange(statements, starts, block, i, k, begin)):
+            statements, starts, block, i = path.pop()
+            k = i + 1
+            begin = self._indexOf(starts[i])
+        return self.statements
+
+    # Index of a token in the token list, or -1 if it was replaced
+    def _indexOf(self, token: LexToken) -> int:
+        tokens = self.tokens
+        i = bisect_left(tokens, token.lexpos, key=_lexpos)
+        return i if (i < len(tokens) and tokens[i] is token) else -1
+
+    # The block written in statement (not inside another one) that holds
+    # all of tokens[first - 1:last + 1] within its braces, or None
+    def _blockAround(self, statement: Stmt.Stmt, first: int, last: int) -> Stmt.Block:
+        pending = [statement]
+        while pending:
+            match pending.pop():
+                case Stmt.Block(span=None) as s:
+                    pending += s.statements
+                case Stmt.Block() as s:
+                    if (0 <= self._indexOf(s.span[0]) < first and self._indexOf(s.span[1]) >= last):
+                        return s
+                case Stmt.If() as s:
+                    pending += [s.thenBranch, s.elseBranch]
+                case Stmt.While() as s:
+                    pending.append(s.body)
+        return None
+
+    # Parses the statements of block (or the top level) from the token at
+    # begin, in place of statements[i:k], and on until one starts at the
+    # same token as an old statement after those. Returns False, leaving the
+    # statements as they were, if the block doesn't end at its old '}'.
+    def _reparseRange(self, statements: list, starts: list, block: Stmt.Block, i: int, k: int, begin: int) -> bool:
+        end = self._indexOf(block.span[1]) if block else None
+        new: list[Stmt.Stmt] = []
+        newStarts: list[LexToken] = []
+        self.current = begin
+        while True:
+            if (block):
+                if (self.check(Kind.RIGHT_BRACE) or self.isAtEnd()):
+                    if (self.current != end): return False
+                    k = len(statements)
+                    break
+                if (self.current > end): return False
+            elif (self.isAtEnd()):
+                k = len(statements)
+                break
+
+            # Old statements from k on start after the edit
+            at = -1
+            while (k < len(starts)):
+                at = self._indexOf(starts[k])
+                if (at >= self.current): break
+                k += 1
+            if (at == self.current): break
+
+            newStarts.append(self.peek())
+            new.append(self.declaration())
+
+        statements[i:k] = new
+        starts[i:k] = newStarts
+        return True
+
+    # Parses the tokens (ending with EOF, like scanner.tokens() yields them)
+    # as they are read, and yields each top-level declaration as soon as it's
+    # complete. Only the tokens of the statement being parsed are held, so
+    # memory doesn't grow with the length of the input.
+    def iter_parse(self, tokens: Iterable[LexToken]) -> Iterator[Stmt.Stmt]:
+        self._source = iter(tokens)
+        self.tokens = []
+        self.kinds = array('B')
+        self.current = 0
+        self._filled = 0
+        self._pull()
+
+        while (not self.isAtEnd()):
+            statement = self.declaration()
+
+            # Drop the tokens of the finished statement
+            del self.tokens[:self.current]
+            del self.kinds[:self.current]
+            self._filled -= self.current
+            self.current = 0
+
+            yield statement
+
+    # Buffers the next token from iter_parse(), if there is one
+    def _pull(self) -> bool:
+        token = next(self._source, None) if self._source else None
+        if (token is None): return False
+        self.tokens.append(token)
+        self.kinds.append(_kinds[token.type])
+        return True
+
+    # Buffers the tokens that the statement starting at the current token
+    # can look at. Statements and the heads of compound statements end at
+    # the first ';', '{' or '}' outside parentheses; after that the parser
+    # only looks at the closing braces and 'else's that follow, and the next
+    # token. A parse error before then stops at one of these tokens, and
+    # _synchronize() reads on by itself.
+    def _fill(self):
+        kinds = self.kinds
+        i = self.current
+        depth = 0
+        while True:
+            if (i == len(kinds) and not self._pull()): return
+            kind = kinds[i]
+            i += 1
+            if (kind == Kind.LEFT_PAREN): depth += 1
+            elif (kind == Kind.RIGHT_PAREN): depth -= 1
+            elif (kind == Kind.EOF): break
+            elif (depth <= 0 and kind in _endKinds): break
+
+        # Statements starting before here (the bodies of compound statements
+        # whose heads were just read) end at the same token
+        self._filled = i
+        while True:
+            if (i == len(kinds) and not self._pull()): return
+            i += 1
+            if (kinds[i - 1] not in _closeKinds): return
+
     # RD methods
+    # Nested statements and expressions are parsed with explicit stacks
+    # instead of recursive calls, so that deeply nested input can't run out
+    # of Python stack (see _parseStatement() and expression()).
 
     def declaration(self) -> Stmt.Stmt:
-        try:
-            if (self.match(*_variableTypes)): return self.varsDeclaration()
-            return self.statement()
-        except ParseError as e:
-            self._synchronize()
-            return None
-    
+        return self._parseStatement(True)
+
+    def statement(self) -> Stmt.Stmt:
+        return self._parseStatement(False)
+
+    # Parses one statement (a declaration, if declaration is set). Compound
+    # statements push a frame that waits for the statements in their body;
+    # each finished statement is handed to the innermost frame, until one is
+    # left over for the caller.
+    def _parseStatement(self, declaration: bool) -> Stmt.Stmt:
+        frames: list = []
+        node = _MORE
+        while True:
+            try:
+                if (node is _MORE):
+                    if (frames and frames[-1].isEnd(self)): node = frames.pop().close(self)
+                    else: node = self._startStatement(frames, frames[-1].declarations if frames else declaration)
+
+                while (node is not _MORE):
+                    if (not frames): return node
+                    frame = frames.pop()
+                    node = frame.add(self, node)
+                    if (node is _MORE): frames.append(frame)
+
+            # A declaration that fails is skipped. The frames waiting for it
+            # fail with it, up to the block it's in. Once diagnostics has
+            # all the errors it keeps, the rest of the input is skipped.
+            except ParseError as e:
+                if (self.diagnostics.full):
+                    self._skipToEnd()
+                    return None
+                while (frames and not frames[-1].declarations): frames.pop()
+                if (not frames and not declaration): raise
+                self._synchronize()
+                node = None
+
+    # Parses a simple statement and returns it, or parses the start of a
+    # compound one and pushes its frame, returning _MORE
+    def _startStatement(self, frames: list, declaration: bool):
+        if (self.current >= self._filled): self._fill()
+        kind = self.kinds[self.current]
+        head = _compoundRules.get(kind)
+        if (head is not None):
+            self.current += 1
+            frames.append(head(self))
+            return _MORE
+
+        rule = (_declarationRules if declaration else _statementRules).get(kind)
+        if (rule is None): return self.expressionStatement()
+        self.current += 1
+        return rule(self)
 
     def varsDeclaration(self) -> Stmt.Stmt:
         type = self.previous().type
@@ -97,232 +374,190 @@ class RDParser:
         
         declarations.append(self._var_sub_declaration(type))
         
-        while (self.match(Token.COMMA)):
+        while (self.match(Kind.COMMA)):
             declarations.append(self._var_sub_declaration(type))
         
-        self.consume(Token.SEMICOLON, "Expected ';' after variable declaration.")
+        self.consume(Kind.SEMICOLON, "Expected ';' after variable declaration.")
         return Stmt.Vars(declarations)
 
     def _var_sub_declaration(self, type:LexToken) -> Stmt.Var:
-        name: LexToken = self.consume(Token.IDENTIFIER, "Expected variable name.")
+        name: LexToken = self.consume(Kind.IDENTIFIER, "Expected variable name.")
         initializer: Expr = None
-        if (self.match(Token.EQUAL)):
+        if (self.match(Kind.EQUAL)):
             initializer = self.expression()
         
         return Stmt.Var(type, name, initializer)
     
 
-    def statement(self) -> Stmt.Stmt:
-        if (self.match(Token.FOR)): return self.forStatement()
-        if (self.match(Token.IF)): return self.ifStatement()
-        if (self.match(Token.COUT)): return self.coutStatement()
-        if (self.match(Token.CIN)): return self.cinStatement()
-
-        if (self.match(Token.WHILE)): return self.whileStatement()
-
-        if (self.match(Token.LEFT_BRACE)): return self.block()
 
-        return self.expressionStatement()
+    # The compound statements parse up to their body and return the frame
+    # that builds them from it
 
-    def forStatement(self) -> Stmt.Stmt:
-        self.consume(Token.LEFT_PAREN, "Expected '(' after 'for'.")
+    def forStatement(self) -> '_ForFrame':
+        self.consume(Kind.LEFT_PAREN, "Expected '(' after 'for'.")
 
         initializer: Stmt.Stmt
-        if (self.match(Token.SEMICOLON)):
+        if (self.match(Kind.SEMICOLON)):
             initializer = None
-        elif (self.match(*_variableTypes)):
+        elif (self.kinds[self.current] in _variableKinds):
+            self.current += 1
             initializer = self.varsDeclaration()
         else:
             initializer = self.expressionStatement()
         
         condition: Expr.Expr = None
-        if (not self.check(Token.SEMICOLON)):
+        if (not self.check(Kind.SEMICOLON)):
             condition = self.expression()
-        self.consume(Token.SEMICOLON, "Expected ';' after loop condition.")
+        self.consume(Kind.SEMICOLON, "Expected ';' after loop condition.")
 
         increment: Expr.Expr = None
-        if (not self.check(Token.RIGHT_PAREN)):
+        if (not self.check(Kind.RIGHT_PAREN)):
             increment = self.expression()
-        self.consume(Token.RIGHT_PAREN, "Exptected ')' after for clauses")
+        self.consume(Kind.RIGHT_PAREN, "Exptected ')' after for clauses")
 
-        body = self.statement()
-
-        # Desugaring
+        return _ForFrame(initializer, condition, increment)
 
-        ## execute increment at end of loop
-        if (increment is not None):
-            body = Stmt.Block([body, Stmt.Expression(increment)])
-        
-        if (condition is None):
-            condition = Expr.Literal(True)
-        body = Stmt.While(condition, body)
-
-        if (initializer is not None):
-            body = Stmt.Block([initializer, body])
-        
-        return body
-
-    def whileStatement(self) -> Stmt.While:
-        self.consume(Token.LEFT_PAREN, "Expected '(' after 'while'.")
+    def whileStatement(self) -> '_WhileFrame':
+        self.consume(Kind.LEFT_PAREN, "Expected '(' after 'while'.")
         condition = self.expression()
-        self.consume(Token.RIGHT_PAREN, "Expected '(' after condition.")
+        self.consume(Kind.RIGHT_PAREN, "Expected '(' after condition.")
 
-        body = self.statement()
-
-        return Stmt.While(condition, body)
+        return _WhileFrame(condition)
 
     
-    def ifStatement(self) -> Stmt.If:
-        self.consume(Token.LEFT_PAREN, "Expected '(' after 'if'.")
+    def ifStatement(self) -> '_IfFrame':
+        self.consume(Kind.LEFT_PAREN, "Expected '(' after 'if'.")
         condition = self.expression()
-        self.consume(Token.RIGHT_PAREN, "Expected ')' after if condition.")
+        self.consume(Kind.RIGHT_PAREN, "Expected ')' after if condition.")
 
-        thenBranch = self.statement()
-        elseBranch = None
-        if (self.match(Token.ELSE)):
-            elseBranch = self.statement()
-        
-        return Stmt.If(condition, thenBranch, elseBranch)
+        return _IfFrame(condition)
         
 
     def coutStatement(self) -> Stmt.Cout:
         expressions:list[Expr.Expr] = []
 
-        while(not self.match(Token.SEMICOLON)):
-            self.consume(Token.LESS_LESS, "Expected '<<' after 'cout'.")
+        while(not self.match(Kind.SEMICOLON)):
+            self.consume(Kind.LESS_LESS, "Expected '<<' after 'cout'.")
             expressions.append(self.expression())  
         return Stmt.Cout(expressions)
     
     def cinStatement(self) -> Stmt.Cin:
         vars:list[LexToken] = []
 
-        while(not self.match(Token.SEMICOLON)):
-            self.consume(Token.GREATER_GREATER, "Expected '>>' after 'cin'.")
-            vars.append(self.consume(Token.IDENTIFIER, "Expected identifier after '>>'."))
+        while(not self.match(Kind.SEMICOLON)):
+            self.consume(Kind.GREATER_GREATER, "Expected '>>' after 'cin'.")
+            vars.append(self.consume(Kind.IDENTIFIER, "Expected identifier after '>>'."))
         return Stmt.Cin(vars)
     
 
     def expressionStatement(self) -> Stmt.Expression:
         expr = self.expression()
-        self.consume(Token.SEMICOLON, "Expect ';' after expression.")
+        self.consume(Kind.SEMICOLON, "Expect ';' after expression.")
         return Stmt.Expression(expr)
 
-    def block(self) -> Stmt.Block:
-        statements: list[Stmt.Stmt] = []
-
-        while (not self.check(Token.RIGHT_BRACE) and not self.isAtEnd()):
-            statements.append(self.declaration())
-        
-        self.consume(Token.RIGHT_BRACE, "Expected '}' after block.")
-        return Stmt.Block(statements)
+    def block(self) -> '_BlockFrame':
+        return _BlockFrame(self.previous() if self.spans else None)
 
 
 
     ## Expressions
+    # Operators are parsed by precedence climbing over _infixRules, with
+    # explicit operand and operator stacks. Prefix operators, '(' and '='
+    # wait on the operator stack for the expression after them, and an
+    # operator is applied once the next one binds less tightly, so this
+    # builds the same trees as the recursive grammar.
 
     def expression(self) -> Expr.Expr:
-        return self.assignment()
-    
-    def assignment(self) -> Expr.Expr:
-        expr = self.orExpr()
-
-        if (self.match(Token.EQUAL)):
-            equals = self.previous()
-            value = self.assignment()
-
-            if (isinstance(expr, Expr.Identifier)):
-                name = expr.name
-                return Expr.Assign(name, value)
-            
-            _error(equals, "Invalid assignment target.")
-
-        return expr
-
-    # binary operators
-    def orExpr(self) -> Expr.Expr:
-        expr = self.andExpr()
-
-        while (self.match(Token.BAR_BAR)):
-            operator = self.previous()
-            right = self.andExpr()
-            expr = Expr.Logical(expr, operator, right)
-        
-        return expr
-
-    def andExpr(self) -> Expr.Expr:
-        expr = self.equality()
-
-        while (self.match(Token.AMP_AMP)):
-            operator = self.previous()
-            right = self.equality()
-            expr = Expr.Logical(expr, operator, right)
-        
-        return expr
-    
-    def equality(self) -> Expr.Expr:
-        expr = self.comparison()
-        while (self.match(Token.BANG_EQUAL, Token.EQUAL_EQUAL)):
-            operator = self.previous()
-            right = self.comparison()
-            expr = Expr.Binary(expr, operator, right)
-        
-        return expr
-    
-    def comparison(self) -> Expr.Expr:
-        expr = self.term()
-
-        while (self.match(Token.GREATER, Token.GREATER_EQUAL, Token.LESS, Token.LESS_EQUAL)):
-            operator = self.previous()
-            right: Expr = self.term()
-            expr = Expr.Binary(expr, operator, right)
-        
-        return expr
-    
-    def term(self) -> Expr.Expr:
-        expr = self.factor()
-
-        while (self.match(Token.MINUS, Token.PLUS)):
-            operator = self.previous()
-            right = self.factor()
-            expr = Expr.Binary(expr, operator, right)
-        
-        return expr
-    
-    def factor(self) -> Expr.Expr:
-        expr = self.unary()
-        while (self.match(Token.SLASH, Token.STAR, Token.PERCENT)):
-            operator = self.previous()
-            right = self.unary()
-            expr = Expr.Binary(expr, operator, right)
-        return expr
-    
-    # unary operators
-
-    def unary(self) -> Expr.Expr:
-        if (self.match(Token.BANG, Token.MINUS)):
-            operator = self.previous()
-            right = self.unary()
-            return Expr.Unary(operator, right)
-        
-        return self.primary()
+        kinds = self.kinds
+        operands: list[Expr.Expr] = []
+        # (power, operator token, node class) entries; '(' is _GROUP
+        operators: list[tuple] = []
+
+        while True:
+            # unary operators and groupings before an operand
+            kind = kinds[self.current]
+            while (kind in _prefixKinds or kind == Kind.LEFT_PAREN):
+                self.current += 1
+                operators.append(_GROUP if kind == Kind.LEFT_PAREN else (_UNARY_POWER, self.previous(), Expr.Unary))
+                kind = kinds[self.current]
+            operands.append(self.primary())
+
+            while True:
+                kind = kinds[self.current]
+                rule = _infixRules.get(kind)
+                if (rule is not None):
+                    if (operators and operators[-1][0] >= rule[0]):
+                        self._reduce(operands, operators, rule[0])
+                    self.current += 1
+                    operators.append((rule[0], self.previous(), rule[1]))
+                    break
+
+                # assignment is right associative
+                if (kind == Kind.EQUAL):
+                    if (operators and operators[-1][0] >= 1):
+                        self._reduce(operands, operators, 1)
+                    self.current += 1
+                    operators.append((0, self.previous(), Expr.Assign))
+                    break
+
+                # The innermost expression ends here
+                if (operators): self._reduce(operands, operators, 0)
+                if (not operators): return operands.pop()
+                self.consume(Kind.RIGHT_PAREN, "Expected ')' after expression.")
+                operators.pop()
+                operands[-1] = Expr.Grouping(operands[-1])
+
+    # Applies the operators on top of the stack that bind at least as
+    # tightly as minPower
+    def _reduce(self, operands: list, operators: list, minPower: int):
+        while (operators and operators[-1][0] >= minPower):
+            power, operator, node = operators.pop()
+            if (node is Expr.Unary):
+                operands[-1] = Expr.Unary(operator, operands[-1])
+            elif (node is Expr.Assign):
+                value = operands.pop()
+                expr = operands[-1]
+                if (isinstance(expr, Expr.Identifier)):
+                    name = expr.name
+                    operands[-1] = Expr.Assign(name, value)
+                else:
+                    self._error(operator, "Invalid assignment target.")
+            else:
+                right = operands.pop()
+                operands[-1] = node(operands[-1], operator, right)
     
     def primary(self) -> Expr.Expr:
-        if (self.match(Token.FALSE)): return Expr.Literal(False)
-        if (self.match(Token.TRUE)): return Expr.Literal(True)
-        
-        if (self.match(Token.NUMBER, Token.DECIMAL, Token.STRING, Token.ENDL)): return Expr.Literal(self.previous().value)
-
-        if (self.match(Token.IDENTIFIER)):
-            return Expr.Identifier(self.previous())
-        
-        if (self.match(Token.LEFT_PAREN)):
-            expr = self.expression()
-            self.consume(Token.RIGHT_PAREN, "Expected ')' after expression.")
-            return Expr.Grouping(expr)
-        
-        print(f'DEBUG: {self.peek()}')
-
-        raise _error(self.peek(), "Expected expression.")
+        kind = self.kinds[self.current]
+        if (kind in _literalKinds):
+            self.current += 1
+            return self.literal(self.previous().value)
+
+        if (kind == Kind.IDENTIFIER):
+            self.current += 1
+            if (self.locations): return Expr.Identifier(self.previous())
+            name = self.previous()
+            identifier = self._identifiers.get(name.value)
+            if (identifier is None):
+                identifier = self._identifiers[name.value] = Expr.Identifier(name)
+            return identifier
+
+        if (kind == Kind.FALSE):
+            self.current += 1
+            return self.literal(False)
+        if (kind == Kind.TRUE):
+            self.current += 1
+            return self.literal(True)
+
+        raise self._error(self.peek(), "Expected expression.")
+
+    # The shared Literal node of value. Values that compare equal but print
+    # differently, like 1, 1.0 and True, get their own.
+    def literal(self, value) -> Expr.Literal:
+        key = (type(value), value)
+        literal = self._literals.get(key)
+        if (literal is None):
+            literal = self._literals[key] = Expr.Literal(value)
+        return literal
         
         
     
@@ -337,30 +572,32 @@ class RDParser:
     # Base methods
         
         
-    def consume(self, type: Token, msg:str):
-        if (self.check(type)): return self.advance()
-
-        raise _error(self.peek(), msg)
-
-    def match(self, *tokenTypes: Token) -> bool:
-        for t in tokenTypes:
-            if (self.check(t)):
-                self.advance()
-                return True
+    # Token kinds are the ints of lexer_rules.Kind. The EOF token is never
+    # asked for, so it doesn't need its own check.
+    def consume(self, kind: int, msg:str):
+        if (self.kinds[self.current] == kind):
+            self.current += 1
+            return self.tokens[self.current - 1]
+
+        raise self._error(self.peek(), msg)
+
+    def match(self, *kinds: int) -> bool:
+        if (self.kinds[self.current] in kinds):
+            self.current += 1
+            return True
             
         return False
     
 
-    def check(self, tokenType: Token) -> bool: 
-        if (self.isAtEnd()): return False
-        return self.peek().type == tokenType.value
+    def check(self, kind: int) -> bool: 
+        return self.kinds[self.current] == kind
     
     def advance(self) -> LexToken:
         if (not self.isAtEnd()): self.current+=1
         return self.previous()
     
     def isAtEnd(self) -> bool:
-        return self.peek().type == Token.EOF
+        return self.kinds[self.current] == Kind.EOF
     
     def peek(self) -> LexToken:
         return self.tokens[self.current]
@@ -370,23 +607,138 @@ class RDParser:
     
     
     ## Error handling
+    def _error(self, token: LexToken, message: str) -> 'ParseError':
+        self.diagnostics.parseError(token, message)
+        return ParseError()
+
     # Drop tokens until after ';' or beggining of statement
     def _synchronize(self):
         self.advance()
 
-        while(not self.isAtEnd()):
-            if (self.previous().type == Token.SEMICOLON): return
-
-            match self.peek().type:
-                case Token.BOOL |Token.CHAR |Token.CIN |Token.COUT |Token.DOUBLE |Token.ELSE |Token.ENDL |Token.FALSE |Token.FLOAT |Token.FOR |Token.IF |Token.INT |Token.SHORT |Token.TRUE |Token.WHILE:
-                    return
+        # With iter_parse(), skipped tokens are read one at a time
+        while(self.current < len(self.kinds) or self._pull()):
+            if (self.isAtEnd()): break
+            if (self.kinds[self.current - 1] == Kind.SEMICOLON): break
+            if (self.kinds[self.current] in _synchronizeKinds): break
                 
             self.advance()
 
+        # and parsing goes on from where this stops
+        if (self._source is not None): self._fill()
+
+    # Moves to the EOF token. With iter_parse(), the remaining tokens are
+    # read without being kept.
+    def _skipToEnd(self):
+        if (self._source is not None):
+            last = None
+            for last in self._source: pass
+            if (last is not None):
+                self.tokens.append(last)
+                self.kinds.append(_kinds[last.type])
+            self._filled = len(self.kinds)
+        self.current = len(self.kinds) - 1
+
                 
+def _lexpos(token: LexToken) -> int:
+    return token.lexpos
+
+# First token kind -> rule for the rest of the statement
+_compoundRules = {
+    Kind.FOR: RDParser.forStatement,
+    Kind.IF: RDParser.ifStatement,
+    Kind.WHILE: RDParser.whileStatement,
+    Kind.LEFT_BRACE: RDParser.block,
+}
+
+_statementRules = {
+    Kind.COUT: RDParser.coutStatement,
+    Kind.CIN: RDParser.cinStatement,
+}
+
+_declarationRules = {
+    **_statementRules,
+    **dict.fromkeys(_variableKinds, RDParser.varsDeclaration),
+}
+
+# Frames of the compound statements being parsed. add() takes the next
+# statement of the body and returns the finished statement, or _MORE when
+# another one is needed.
+_MORE = object()
+
+class _Frame:
+    # Whether the statements in the body are declarations
+    declarations = False
+
+    # Whether the body ended before another statement
+    def isEnd(self, parser: RDParser) -> bool:
+        return False
+
+class _BlockFrame(_Frame):
+    declarations = True
+
+    def __init__(self, brace: LexToken):
+        self.brace = brace
+        self.statements: list[Stmt.Stmt] = []
+        self.starts: list[LexToken] = [] if brace else None
+
+    # Asked before each statement of the body, which starts here if the
+    # block doesn't end
+    def isEnd(self, parser: RDParser) -> bool:
+        if (parser.check(Kind.RIGHT_BRACE) or parser.isAtEnd()): return True
+        if (self.brace): self.starts.append(parser.peek())
+        return False
+
+    def add(self, parser: RDParser, statement: Stmt.Stmt):
+        self.statements.append(statement)
+        return _MORE
+
+    def close(self, parser: RDParser) -> Stmt.Block:
+        brace = parser.consume(Kind.RIGHT_BRACE, "Expected '}' after block.")
+        if (not self.brace): return Stmt.Block(self.statements)
+        return Stmt.Block(self.statements, (self.brace, brace), self.starts)
+
+class _IfFrame(_Frame):
+    def __init__(self, condition: Expr.Expr):
+        self.condition = condition
+        self.thenBranch: Stmt.Stmt = _MORE
+
+    def add(self, parser: RDParser, statement: Stmt.Stmt):
+        if (self.thenBranch is not _MORE):
+            return Stmt.If(self.condition, self.thenBranch, statement)
+
+        self.thenBranch = statement
+        if (parser.match(Kind.ELSE)): return _MORE
+        return Stmt.If(self.condition, statement, None)
+
+class _WhileFrame(_Frame):
+    def __init__(self, condition: Expr.Expr):
+        self.condition = condition
+
+    def add(self, parser: RDParser, body: Stmt.Stmt):
+        return Stmt.While(self.condition, body)
+
+class _ForFrame(_Frame):
+    def __init__(self, initializer: Stmt.Stmt, condition: Expr.Expr, increment: Expr.Expr):
+        self.initializer = initializer
+        self.condition = condition
+        self.increment = increment
+
+    def add(self, parser: RDParser, body: Stmt.Stmt):
+        # Desugaring
+
+        ## execute increment at end of loop
+        if (self.increment is not None):
+            body = Stmt.Block([body, Stmt.Expression(self.increment)])
+        
+        condition = self.condition
+        if (condition is None):
+            condition = parser.literal(True)
+        body = Stmt.While(condition, body)
+
+        if (self.initializer is not None):
+            body = Stmt.Block([self.initializer, body])
+        
+        return body
+
 ## Error class to stop parsing
 class ParseError(RuntimeError): ...
-
-def _error(token: LexToken, message: str) -> ParseError:
-    state.parseError(token, message)
-    return ParseError()
@@ -1,112 +1,132 @@
+import sys
+from itertools import islice
+from typing import Iterable, TextIO
 import modules.rd_parcer.expressions as Expr
 import modules.rd_parcer.statements as Stmt
+from modules.rd_parcer.visitor import Visitor, flatten
 
 
-def printStmts(statements: list[Stmt.Stmt]):
-    for s in statements:
-        print(stmtToStr(s, tabSize=0))
+# Pieces are written to the file in batches of this many, so neither a
+# statement nor the whole output is ever held as one string
+_BATCH = 4096
+
+# Writes each statement on its own lines to file (sys.stdout by default)
+# as the statements come, such as from RDParser.iter_parse()
+def printStmts(statements: Iterable[Stmt.Stmt], file: TextIO = None):
+    write = (file or sys.stdout).write
+    pieces = _pieces(part for s in statements for part in ((s, 0), '\n'))
+    while True:
+        batch = list(islice(pieces, _BATCH))
+        if (not batch): break
+        write(''.join(batch))
+
+# The tree is walked with visitor.flatten() instead of recursion, so
+# nesting depth is only limited by memory. _Parts gives the parts of each
+# node: strings, (statement, tabSize) pairs and expressions. Nodes with a
+# list of children give their parts as they're needed.
 
 def stmtToStr(statement:Stmt.Stmt, tabSize = 4):
-    offset = ' '*tabSize
-    if (statement is None): return offset
-    match statement:
-        case Stmt.Cout():
-            return offset + ' '.join([
-                '(',
-                'cout',
-                ' '.join([toStr(e) for e in statement.expressions]),
-                ')'
-            ])
-        
-        case Stmt.Cin():
-            return offset + ' '.join([
-                '(',
-                'cin',
-                ' '.join([v.value for v in statement.variables]),
-                ')'
-            ])
-        
-
-        case Stmt.Expression():
-            return offset + ' '.join([
-                '(',
-                'EXPR',
-                toStr(statement.expression),
-                ')'
-            ])
-        
-        case Stmt.Var():
-            return offset + ' '.join([
-                '(',
-                f'[{statement.type}]',
-                statement.name.value,
-                toStr(statement.initializer),
-                ')'
-            ])
-
-        case Stmt.Vars():
-            return '\n'.join([offset + stmtToStr(s,0) for s in statement.declarations])
-        
-        case Stmt.Block():
-            return '\n'.join(
-                [f'{offset}{{']
-                + [offset+stmtToStr(s) for s in statement.statements]
-                + [f'{offset}}}']
-            )
-        
-        case Stmt.If():
-            return '\n'.join(map( lambda s: offset + s ,[
-                '(if ' + toStr(statement.condition),
-                stmtToStr(statement.thenBranch),
-                'else',
-                stmtToStr(statement.elseBranch),
-                ')'
-                
-            ]))
-        
-        case Stmt.While():
-            return '\n'.join(map(lambda s: offset+s, [
-                f'(while {toStr(statement.condition)}',
-                stmtToStr(statement.body),
-                ')'
-            ]))
-    
+    return ''.join(_pieces([(statement, tabSize)]))
 
 def toStr(parseTree: Expr.Expr) -> str:
-    if (parseTree is None): return ''
-    match parseTree:   
-        case Expr.Assign():
-            return ' '.join([
-                '(',
-                parseTree.name.value,
-                '=',
-                toStr(parseTree.value),
-                ')'
-            ])
-        
-        case Expr.Binary() | Expr.Logical():
-            return ' '.join([
-                '(',
-                parseTree.operator.value,
-                toStr(parseTree.left),
-                toStr(parseTree.right),
-                ')'
-            ])
-        
-        case Expr.Unary():
-            return ' '.join(['(',
-                  parseTree.operator.value,
-                  toStr(parseTree.expression),
-                  ')'
-            ])
-        case Expr.Grouping():
-            return ' '.join(['(',
-                  toStr(parseTree.expression),
-                  ')'
-            ])
-        
-        case Expr.Literal():
-            return str(parseTree.value)
-        
-        case Expr.Identifier():
-            return str(parseTree.name.value)
\ No newline at end of file
+    return ''.join(_pieces([parseTree]))
+
+def _pieces(parts: Iterable):
+    return flatten(parts, _parts.visit)
+
+# Statements are visited with their tabSize. Only the first line of a
+# nested statement gets the offset of its parent.
+class _Parts(Visitor):
+    def generic(self, node, tabSize: int = None) -> list:
+        return []
+
+    def visitNone(self, node, tabSize: int = None) -> list:
+        return [] if (tabSize is None) else [' '*tabSize]
+
+    def visitCout(self, statement: Stmt.Cout, tabSize: int):
+        yield ' '*tabSize
+        yield '( cout '
+        for i, e in enumerate(statement.expressions):
+            if (i): yield ' '
+            yield e
+        yield ' )'
+
+    def visitCin(self, statement: Stmt.Cin, tabSize: int) -> list:
+        return [' '*tabSize + ' '.join([
+            '(',
+            'cin',
+            ' '.join([v.value for v in statement.variables]),
+            ')'
+        ])]
+
+    def visitExpression(self, statement: Stmt.Expression, tabSize: int) -> list:
+        return [' '*tabSize, '( EXPR ', statement.expression, ' )']
+
+    def visitVar(self, statement: Stmt.Var, tabSize: int) -> list:
+        return [
+            ' '*tabSize, '( ',
+            f'[{statement.type}]', ' ',
+            statement.name.value, ' ',
+            statement.initializer, ' )'
+        ]
+
+    def visitVars(self, statement: Stmt.Vars, tabSize: int):
+        offset = ' '*tabSize
+        for i, s in enumerate(statement.declarations):
+            if (i): yield '\n'
+            yield offset
+            yield (s, 0)
+
+    def visitBlock(self, statement: Stmt.Block, tabSize: int):
+        offset = ' '*tabSize
+        yield f'{offset}{{'
+        for s in statement.statements:
+            yield '\n'
+            yield offset
+            yield (s, 4)
+        yield '\n'
+        yield f'{offset}}}'
+
+    def visitIf(self, statement: Stmt.If, tabSize: int) -> list:
+        offset = ' '*tabSize
+        return [
+            offset, '(if ', statement.condition, '\n',
+            offset, (statement.thenBranch, 4), '\n',
+            offset, 'else', '\n',
+            offset, (statement.elseBranch, 4), '\n',
+            offset, ')'
+        ]
+
+    def visitWhile(self, statement: Stmt.While, tabSize: int) -> list:
+        offset = ' '*tabSize
+        return [
+            offset, '(while ', statement.condition, '\n',
+            offset, (statement.body, 4), '\n',
+            offset, ')'
+        ]
+
+    def visitAssign(self, parseTree: Expr.Assign) -> list:
+        return ['( ', parseTree.name.value, ' = ', parseTree.value, ' )']
+
+    def visitBinary(self, parseTree: Expr.Binary) -> list:
+        return [
+            '( ', parseTree.operator.value, ' ',
+            parseTree.left, ' ',
+            parseTree.right, ' )'
+        ]
+
+    visitLogical = visitBinary
+
+    def visitUnary(self, parseTree: Expr.Unary) -> list:
+        return ['( ', parseTree.operator.value, ' ', parseTree.expression, ' )']
+
+    def visitGrouping(self, parseTree: Expr.Grouping) -> list:
+        return ['( ', parseTree.expression, ' )']
+
+    def visitLiteral(self, parseTree: Expr.Literal) -> list:
+        return [str(parseTree.value)]
+
+    def visitIdentifier(self, parseTree: Expr.Identifier) -> list:
+        return [str(parseTree.name.value)]
+
+_parts = _Parts()
@@ -0,0 +1,45 @@
+import modules.rd_parcer.expressions as Expr
+import modules.rd_parcer.statements as Stmt
+
+# What the fields of the node classes hold. The traversal in visitor, the
+# arena and the output formats are all derived from this table, so a new
+# node class only has to be added here (and to the visitors that handle it).
+
+# Kinds of fields
+NODE = 0      # a node, or None
+NODES = 1     # a list of nodes
+TOKEN = 2     # a token
+TOKENS = 3    # a list of tokens
+VALUE = 4     # a literal value or a token type
+
+# Fields of each node class, in the order its constructor takes them, which
+# is also source order
+fields = {
+    Expr.Assign: (('name', TOKEN), ('value', NODE)),
+    Expr.Binary: (('left', NODE), ('operator', TOKEN), ('right', NODE)),
+    Expr.Unary: (('operator', TOKEN), ('expression', NODE)),
+    Expr.Literal: (('value', VALUE),),
+    Expr.Grouping: (('expression', NODE),),
+    Expr.Identifier: (('name', TOKEN),),
+    Expr.Logical: (('left', NODE), ('operator', TOKEN), ('right', NODE)),
+    Stmt.Expression: (('expression', NODE),),
+    Stmt.Cout: (('expressions', NODES),),
+    Stmt.Cin: (('variables', TOKENS),),
+    Stmt.Var: (('type', VALUE), ('name', TOKEN), ('initializer', NODE)),
+    Stmt.Vars: (('declarations', NODES),),
+    Stmt.Block: (('statements', NODES),),
+    Stmt.If: (('condition', NODE), ('thenBranch', NODE), ('elseBranch', NODE)),
+    Stmt.While: (('condition', NODE), ('body', NODE)),
+}
+
+_nodeClasses = {cls: cls for cls in fields}
+
+# The node class that cls is, or derives from, like the views of
+# arena.Arena
+def nodeClass(cls: type) -> type:
+    base = _nodeClasses.get(cls)
+    if (base is None):
+        base = next((base for base in cls.__mro__ if base in fields), None)
+        if (base is None): raise TypeError(f'not a tree node: {cls.__name__}')
+        _nodeClasses[cls] = base
+    return base
@@ -2,43 +2,58 @@ from modules.ply_lex import LexToken
 import modules.rd_parcer.expressions as Expr
 from modules.lexer_rules import Token
 
-class Stmt: ...
+# Slotted, like the nodes in expressions.py
+class Stmt:
+    __slots__ = ()
 
 class Expression(Stmt):
+    __slots__ = ('expression',)
     def __init__(self, expr: Expr.Expr):
         self.expression = expr
 
 class Cout(Stmt):
+    __slots__ = ('expressions',)
     def __init__(self, exprs: list[Expr.Expr]):
         self.expressions: list[Expr.Expr] = exprs
 
 class Cin(Stmt):
+    __slots__ = ('variables',)
     def __init__(self, vars: list[LexToken]):
         self.variables: list[LexToken] = vars
 
 # There should be a separate node for each type.
 # But statements only need to be recognized, not evaluated
 class Var(Stmt):
+    __slots__ = ('type', 'name', 'initializer')
     def __init__(self, type:Token,  name:LexToken, initializer: Expr.Expr):
         self.type = type
         self.name = name
         self.initializer = initializer
 
 class Vars(Stmt):
+    __slots__ = ('declarations',)
     def __init__(self, declarations: list[Var]):
         self.declarations = declarations
 
 class Block(Stmt):
-    def __init__(self, stmts: list[Stmt]):
+    __slots__ = ('statements', 'span', 'starts')
+    # Blocks written in braces know the tokens they span, '{' to '}', and
+    # the first token of each of their statements. Blocks made up by the
+    # parser (for loops) have no span.
+    def __init__(self, stmts: list[Stmt], span: tuple[LexToken, LexToken] = None, starts: list[LexToken] = None):
         self.statements = stmts
+        self.span = span
+        self.starts = starts
 
 class If(Stmt):
+    __slots__ = ('condition', 'thenBranch', 'elseBranch')
     def __init__(self, condition: Expr.Expr, thenBranch: Stmt, elseBranch: Stmt):
         self.condition = condition
         self.thenBranch = thenBranch
         self.elseBranch = elseBranch
 
 class While(Stmt):
+    __slots__ = ('condition', 'body')
     def __init__(self, condition: Expr.Expr, body: Stmt):
         self.condition = condition
         self.body = body
\ No newline at end of file
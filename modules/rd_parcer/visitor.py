@@ -0,0 +1,102 @@
+from typing import Callable, Iterable, Iterator
+from modules.rd_parcer import schema
+
+
+class Visitor:
+    # Passes over the tree subclass Visitor and define a method for each
+    # node class they handle: visitBinary(node, ...), visitBlock(node, ...)
+    # and so on, and visitNone for missing nodes (an if without else). A
+    # class without a method of its own is handled by the method of its
+    # nearest base class that has one, such as visitExpr or visitStmt, and
+    # otherwise by generic().
+    #
+    # visit() looks the method up in a table keyed by the class of the
+    # node, so dispatch takes one dict lookup whatever the number of node
+    # classes. Each subclass has its own table, filled in the first time it
+    # meets a class.
+    _methods: dict = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._methods = {}
+
+    def visit(self, node, *args):
+        method = self._methods.get(type(node))
+        if (method is None): method = self._resolve(type(node))
+        return method(self, node, *args)
+
+    def generic(self, node, *args):
+        return None
+
+    @classmethod
+    def _resolve(cls, nodeClass: type):
+        names = ['visitNone'] if (nodeClass is type(None)) else ['visit' + base.__name__ for base in nodeClass.__mro__]
+        method = next((getattr(cls, name) for name in names if hasattr(cls, name)), cls.generic)
+        cls._methods[nodeClass] = method
+        return method
+
+
+# Fields of each node class that hold nodes, in source order. Cin's
+# variables are tokens, so it has none.
+_childFields = {
+    cls: tuple(name for name, kind in fields if kind in (schema.NODE, schema.NODES))
+    for cls, fields in schema.fields.items()
+}
+
+# The nodes directly under node, in source order. Missing ones are left
+# out, or given as None if missing is set.
+def children(node, missing: bool = False) -> list:
+    fields = _childFields.get(type(node))
+    if (fields is None):
+        fields = _childFields[type(node)] = _childFields[schema.nodeClass(type(node))]
+
+    nodes = []
+    for field in fields:
+        child = getattr(node, field)
+        if (isinstance(child, list)): nodes += child
+        elif (child is not None or missing): nodes.append(child)
+    return nodes
+
+# Yields node and every node under it, each before the nodes under it and
+# in source order. The tree is walked with an explicit stack, so nesting
+# depth and the length of statement lists don't matter.
+def walk(node) -> Iterator:
+    work = [node]
+    while work:
+        node = work.pop()
+        yield node
+        work.extend(reversed(children(node)))
+
+# Like walk(), but each node comes after the nodes under it, as when a tree
+# is built bottom-up. With missing set, missing nodes are yielded as None.
+def postorder(node, missing: bool = False) -> Iterator:
+    # (node, False) until the nodes under it are on the stack
+    work = [(node, False)]
+    while work:
+        node, expanded = work.pop()
+        if (expanded or node is None):
+            yield node
+        else:
+            work.append((node, True))
+            work.extend((child, False) for child in reversed(children(node, missing)))
+
+_END = object()
+
+# Yields the strings of parts in order, putting in place of each node, or
+# (node, *args) tuple, the parts that visit(node, *args) returns for it,
+# which can hold nodes in turn. The stack holds an iterator over the parts
+# of each node being expanded, so nesting depth is only limited by memory,
+# and nodes with a list of children can give their parts as a generator so
+# that the stack only grows with nesting depth.
+def flatten(parts: Iterable, visit: Callable) -> Iterator[str]:
+    stack = [iter(parts)]
+    while stack:
+        item = next(stack[-1], _END)
+        if (item is _END):
+            stack.pop()
+        elif (isinstance(item, str)):
+            yield item
+        elif (isinstance(item, tuple)):
+            stack.append(iter(visit(*item)))
+        else:
+            stack.append(iter(visit(item)))
@@ -1,24 +1,344 @@
+from array import array
+from bisect import bisect_left
+import codecs
 import modules.ply_lex as _lex
 from modules import lexer_rules as _rules
+from modules import lexprofile as _profile
+from modules import lexsignature as _lexsignature
 from modules import state
 
-_rules.onCharError = lambda char, line: state.error(line, f"Illegal character '{char}'")
-_lexer = _lex.lex(module=_rules)
+# Each run of illegal characters is reported once, to the diagnostics of
+# the scan that found it
+def _onCharError(lexer, chars, line, column):
+    if (len(chars) == 1):
+        lexer.diagnostics.error(line, f"Illegal character '{chars}'", column)
+    else:
+        shown = repr(chars[:16])[1:-1] + ('...' if len(chars) > 16 else '')
+        lexer.diagnostics.error(line, f"{len(chars)} illegal characters '{shown}'", column)
 
-def tokens(source):
-    _lexer.input(source)
+_rules.onCharError = _onCharError
+
+# Lexing gives up after this many runs of illegal characters, so a binary or
+# mis-encoded file doesn't produce a report for every bit of it
+maxErrors = 100
+
+# The scanner generated by `python -m modules.lexgen` produces the same tokens
+# as ply_lex without interpreting the rule tables. It's only used while it was
+# generated from the current rules, generator and ply_lex.
+try:
+    from modules import notc_lexer as _generated
+except ImportError:
+    _generated = None
+
+# Otherwise, optimized mode caches the built tables in modules/lextab.py, so
+# the rules are only validated and compiled again when lexer_rules changes.
+# This lexer is never fed any input: it only holds the compiled tables that
+# every call clones, so concurrent scans don't share any position state.
+# Both try the rules in the order of the match counts in modules/lexprofile.py.
+if (_generated and getattr(_generated, 'tabversion', None) == _lex.__tabversion__
+        and _generated.signature == _lexsignature.signature()):
+    _lexer = _generated.Lexer()
+else:
+    _lexer = _lex.lex(module=_rules, optimize=True, lextab='modules.lextab',
+                      profile=_profile.counts)
+
+# Errors are added to diagnostics, or to a new state.Diagnostics kept on
+# the lexer if none is given
+def newLexer(source: str, diagnostics: state.Diagnostics = None) -> _lex.Lexer:
+    lexer = _lexer.clone()
+    lexer.input(source)
+    lexer.lexmaxerrors = maxErrors
+    lexer.diagnostics = diagnostics or state.Diagnostics()
+    return lexer
+
+_IDENTIFIER = _rules.Token.IDENTIFIER.value
+
+class SymbolTable:
+    # The identifiers of one compilation. Each name is stored once, with an
+    # id that numbers the names in the order they were first seen. The
+    # scanner functions replace the value of identifier tokens by the
+    # stored name, so equal names are the same string.
+    def __init__(self):
+        self.names: list[str] = []
+        self.ids: dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    # Returns the id of name, adding it if it's new
+    def intern(self, name: str) -> int:
+        id = self.ids.get(name)
+        if (id is None):
+            id = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return id
+
+    # The stored string equal to name
+    def name(self, name: str) -> str:
+        return self.names[self.intern(name)]
+
+# The names of symbols (or a new table) and its intern(), for the loops
+# that intern each identifier token
+def _interning(symbols: SymbolTable):
+    if (symbols is None): symbols = SymbolTable()
+    return symbols.names, symbols.intern
+
+# Reports that the lexer gave up, and ends its input there
+def _stopped(lexer, error: _lex.LexError):
+    line, column = lexer.lexlines.position(lexer.lexpos)
+    lexer.diagnostics.error(line, str(error), column)
+    lexer.lexpos = lexer.lexlen
+
+# Identifiers are interned in symbols, or a new SymbolTable
+def tokens(source, diagnostics: state.Diagnostics = None, symbols: SymbolTable = None):
+    lexer = newLexer(source, diagnostics)
+    names, intern = _interning(symbols)
     
-    while True:
-        token = _lex.token()
-        if (not token): break
-        yield token
+    try:
+        while True:
+            token = lexer.token()
+            if (not token): break
+            if (token.type == _IDENTIFIER): token.value = names[intern(token.value)]
+            yield token
+    except _lex.LexError as error:
+        _stopped(lexer, error)
     
     eofToken = _lex.LexToken()
     eofToken.type = _rules.Token.EOF
     eofToken.value = None
-    eofToken.lineno = _lexer.lineno
-    eofToken.lexpos = _lexer.lexpos
+    eofToken.lines = lexer.lexlines
+    # Right after the last character. The lexer leaves lexpos one past that.
+    eofToken.lexpos = lexer.lexlen
 
 
     yield eofToken
 
+
+# Re-lexes `tokens` (a list produced by tokens() for `source`) after the text
+# in source[start:end] is replaced by `replacement`. Only the tokens around
+# the edit are lexed again, until the new tokens line up with the old stream;
+# the list is updated in place and the positions of the tokens after that
+# are shifted. Line numbers follow from the positions. Returns (newSource,
+# first, last), where tokens[first:last] are the tokens that were lexed
+# again. Errors in them are added to diagnostics, and identifiers interned
+# in symbols, which should be the table the tokens were lexed with.
+def relex(tokens: list, source: str, start: int, end: int, replacement: str,
+        diagnostics: state.Diagnostics = None, symbols: SymbolTable = None):
+    newSource = source[:start] + replacement + source[end:]
+    delta = len(replacement) - (end - start)
+
+    # No rule matches across a newline, so what the lexer does at any point
+    # only depends on the text up to the end of that line. Everything lexed
+    # on earlier lines is unaffected, so lexing restarts at the last token
+    # before the edited line.
+    eof = len(tokens) - 1
+    lineStart = source.rfind('\n', 0, start) + 1
+    first = max(bisect_left(tokens, lineStart, 0, eof, key=lambda t: t.lexpos) - 1, 0)
+
+    # All tokens share one line index; pointing it at the new text updates
+    # the line numbers of the whole stream at once
+    lines = tokens[eof].lines
+    lines.update(newSource)
+
+    lexer = newLexer(newSource, diagnostics)
+    lexer.lexlines = lines
+    if (first > 0):
+        lexer.lexpos = tokens[first].lexpos
+
+    # Old tokens at or after the end of the edit are lexed from unchanged
+    # text, so once a new token starts where one of them now starts, the
+    # rest of the stream is the same as before
+    old = first
+    relexed = []
+    names, intern = _interning(symbols)
+    try:
+        for token in iter(lexer.token, None):
+            if (token.type == _IDENTIFIER): token.value = names[intern(token.value)]
+            while (old < eof and (tokens[old].lexpos < end
+                    or tokens[old].lexpos + delta < token.lexpos)):
+                old += 1
+            if (old < eof and tokens[old].lexpos + delta == token.lexpos): break
+            relexed.append(token)
+        else:
+            old = eof
+    except _lex.LexError as error:
+        _stopped(lexer, error)
+        old = eof
+
+    tokens[first:old] = relexed
+    last = first + len(relexed)
+
+    if (delta):
+        for token in tokens[last:]:
+            token.lexpos += delta
+
+    return newSource, first, last
+
+
+# Token type for each kind code
+_typeOf = list(_rules.tokens)
+_EOF = _rules.kinds[_rules.Token.EOF]
+_IDENTIFIER_KIND = _rules.kinds[_IDENTIFIER]
+
+# Values that the lexer rules convert from their matched text
+_convert = {
+    _rules.kinds[_rules.Token.NUMBER]: int,
+    _rules.kinds[_rules.Token.DECIMAL]: float,
+}
+
+class TokenTable:
+    # Token stream stored as parallel typed arrays instead of one LexToken
+    # per token. Values are sliced from the source and line numbers looked
+    # up only when asked for. When source is a piece of a larger text that
+    # starts at line firstLine and position base, starts and ends are
+    # positions in source, and the tokens it returns have positions in the
+    # whole text. Lexical errors are added to diagnostics. Identifiers are
+    # interned in symbols when their values are asked for.
+    def __init__(self, source: str, firstLine: int = 1, base: int = 0,
+            diagnostics: state.Diagnostics = None, symbols: SymbolTable = None):
+        self.source = source
+        self.kinds = array('B')
+        self.starts = array('q')
+        self.ends = array('q')
+        self.lines = _lex.LineIndex(source, firstLine, base)
+        # Number of runs of illegal characters found while lexing
+        self.errorCount = 0
+        self.diagnostics = diagnostics or state.Diagnostics()
+        self.symbols = SymbolTable() if (symbols is None) else symbols
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    def __getitem__(self, i: int) -> _lex.LexToken:
+        token = _lex.LexToken()
+        token.type = self.type(i)
+        token.value = self.value(i)
+        token.lexpos = self.starts[i] + self.lines.base
+        token.lines = self.lines
+        return token
+
+    def __iter__(self):
+        for i in range(len(self.kinds)):
+            yield self[i]
+
+    def type(self, i: int) -> str:
+        return _typeOf[self.kinds[i]]
+
+    def text(self, i: int) -> str:
+        return self.source[self.starts[i]:self.ends[i]]
+
+    # The id in symbols of identifier i
+    def symbol(self, i: int) -> int:
+        return self.symbols.intern(self.text(i))
+
+    def value(self, i: int):
+        kind = self.kinds[i]
+        if (kind == _EOF): return None
+        if (kind == _IDENTIFIER_KIND): return self.symbols.names[self.symbol(i)]
+
+        convert = _convert.get(kind)
+        if (convert is None): return self.text(i)
+        return convert(self.text(i))
+
+
+def tokenize_all(source: str, firstLine: int = 1, base: int = 0,
+        diagnostics: state.Diagnostics = None, symbols: SymbolTable = None) -> TokenTable:
+    table = TokenTable(source, firstLine, base, diagnostics, symbols)
+    kinds, starts, ends = table.kinds, table.starts, table.ends
+    kindOf = _rules.kinds
+
+    lexer = newLexer(source, table.diagnostics)
+    lexer.lexlines = _lex.LineIndex(source, firstLine) if base else table.lines
+    token = lexer.token
+    try:
+        while True:
+            tok = token()
+            if (not tok): break
+            kinds.append(kindOf[tok.type])
+            starts.append(tok.lexpos)
+            ends.append(lexer.lexpos)
+    except _lex.LexError as error:
+        _stopped(lexer, error)
+
+    kinds.append(_EOF)
+    starts.append(lexer.lexlen)
+    ends.append(lexer.lexlen)
+    table.errorCount = lexer.lexerrorcount
+
+    return table
+
+
+# Size of the blocks read by tokenize_stream()
+_CHUNK_SIZE = 1 << 16
+
+# Lexes a file-like object (text or binary) or an mmap, reading it in blocks
+# of chunkSize so that memory doesn't grow with the size of the input. No
+# rule matches across a newline, so each block is cut after its last newline
+# and the incomplete line is carried over to the next one; tokens that would
+# straddle a block boundary are always lexed whole. Lines longer than a
+# block are held until they are complete. Errors are added to diagnostics
+# as the tokens are read, and identifiers are interned in symbols. Bytes
+# that aren't valid in encoding become U+FFFD, which is reported as an
+# illegal character, as notc does when it opens a file.
+def tokenize_stream(file, chunkSize: int = _CHUNK_SIZE, encoding: str = 'utf-8',
+        diagnostics: state.Diagnostics = None, symbols: SymbolTable = None):
+    lexer = newLexer('', diagnostics)
+    names, intern = _interning(symbols)
+    decoder = None
+    # Blocks of the incomplete last line, joined once its newline is read
+    pending = []
+    base = 0
+    firstLine = 1
+    stopped = False
+    # Index of the last block, which also places the end of the input
+    lines = _lex.LineIndex('')
+
+    while (not stopped):
+        chunk = file.read(chunkSize)
+        atEnd = not chunk
+        if (isinstance(chunk, bytes)):
+            if (decoder is None): decoder = codecs.getincrementaldecoder(encoding)('replace')
+            chunk = decoder.decode(chunk, final=atEnd)
+        if (not atEnd and '\n' not in chunk):
+            pending.append(chunk)
+            continue
+
+        text = ''.join(pending) + chunk
+        cut = len(text) if atEnd else text.rfind('\n') + 1
+        pending = [text[cut:]]
+        if (cut):
+            block = text[:cut]
+            # The error limit is for the whole stream, not each block
+            errors = lexer.lexerrorcount
+            lexer.input(block)
+            lexer.lexerrorcount = errors
+            lexer.lexlines = _lex.LineIndex(block, firstLine)
+            lines = lexer.lexlines.shifted(base)
+            try:
+                for token in iter(lexer.token, None):
+                    if (token.type == _IDENTIFIER): token.value = names[intern(token.value)]
+                    token.lexpos += base
+                    token.lines = lines
+                    yield token
+            except _lex.LexError as error:
+                _stopped(lexer, error)
+                stopped = True
+            base += cut
+            firstLine += block.count('\n')
+
+        if (atEnd): break
+
+    eofToken = _lex.LexToken()
+    eofToken.type = _rules.Token.EOF
+    eofToken.value = None
+    eofToken.lines = lines
+    eofToken.lexpos = base
+
+    yield eofToken
+
+
+# Each table keeps its own diagnostics
+def tokenize_many(sources, maxWorkers: int = None) -> list[TokenTable]:
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=maxWorkers) as pool:
+        return list(pool.map(tokenize_all, sources))
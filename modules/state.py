@@ -1,22 +1,75 @@
+import sys
+from enum import Enum
+from typing import NamedTuple, TextIO
 from modules.ply_lex import LexToken
 from modules.lexer_rules import Token
 
-hadError = False
 
+class DiagnosticKind(str, Enum):
+    # Illegal characters, and the lexer giving up
+    LEXICAL = 'LEXICAL'
+    # Errors found by the parser
+    SYNTAX = 'SYNTAX'
 
-def error(line: int, msg: str):
-    report(line, "", msg)
+# token is the token a syntax error was found at, without its line index,
+# so records are cheap to pickle. It's None for lexical errors.
+class Diagnostic(NamedTuple):
+    kind: DiagnosticKind
+    line: int
+    column: int
+    token: LexToken
+    message: str
 
+class Diagnostics:
+    # The diagnostics of one run of the scanner and parser, in the order
+    # they were found. Nothing is printed until render() is called.
+    # After maxErrors records, further errors are only counted, and the
+    # parser stops (see full).
+    def __init__(self, maxErrors: int = None):
+        self.records: list[Diagnostic] = []
+        self.maxErrors = maxErrors
+        self.errorCount = 0
 
-def parseError(token: LexToken, msg: str):
-    if (token.type == Token.EOF):
-        report(token.lineno, " at end", msg)
-    else:
-        report(token.lineno, f" at '{token.value}'", msg)
+    @property
+    def hadError(self) -> bool:
+        return self.errorCount > 0
 
+    @property
+    def full(self) -> bool:
+        return self.maxErrors is not None and self.errorCount >= self.maxErrors
 
+    def add(self, record: Diagnostic):
+        self.errorCount += 1
+        if (self.maxErrors is None or len(self.records) < self.maxErrors):
+            self.records.append(record)
 
-def report(line:int, location:str, msg:str):
-    global hadError 
-    hadError = True
-    print(f"[line {line}] Error {location}: {msg}")
+    def extend(self, records):
+        for record in records: self.add(record)
+
+    # Adds the diagnostics of another run, including the errors it only
+    # counted
+    def merge(self, other: 'Diagnostics'):
+        self.extend(other.records)
+        self.errorCount += other.errorCount - len(other.records)
+
+    def error(self, line: int, msg: str, column: int = None):
+        self.add(Diagnostic(DiagnosticKind.LEXICAL, line, column, None, msg))
+
+    def parseError(self, token: LexToken, msg: str):
+        line, column = token.lines.position(token.lexpos)
+        found = LexToken()
+        found.type, found.value, found.lexpos = token.type, token.value, token.lexpos
+        self.add(Diagnostic(DiagnosticKind.SYNTAX, line, column, found, msg))
+
+    def render(self, file: TextIO = None):
+        text = ''.join(map(formatDiagnostic, self.records))
+        if (self.full): text += f'Too many errors, stopped after {self.maxErrors}\n'
+        (file or sys.stdout).write(text)
+
+
+def formatDiagnostic(record: Diagnostic) -> str:
+    where = f"line {record.line}" if record.column is None else f"line {record.line}, column {record.column}"
+    if (record.token is None): location = ""
+    elif (record.token.type == Token.EOF): location = " at end"
+    else: location = f" at '{record.token.value}'"
+    return f"[{where}] Error {location}: {record.message}\n"
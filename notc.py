@@ -1,20 +1,67 @@
+import os
 import sys
 from modules import scanner
 from modules.rd_parcer.parser import RDParser
 from modules.rd_parcer.printer import printStmts
 from modules import state
 
+# NOTC_MAX_ERRORS limits the errors reported for an input, after which
+# parsing stops. Unset or 0, all of them are reported.
+maxErrors = int(os.environ.get('NOTC_MAX_ERRORS', 0)) or None
 
-def run(source:str):
-    tokens = list(scanner.tokens(source))
-    # print(tokens)
-    parser = RDParser(tokens)
+# Statements still have to be read for the parser to run
+def _discard(statements, file=None):
+    for _ in statements: pass
 
-    statements = parser.parse()
+# --format=NAME: how accepted statements are written
+outputFormats = ('sexpr', 'json', 'binary', 'none')
+outputFormat = 'sexpr'
 
-    if (state.hadError): return
-    printStmts(statements)
-    print ("Accepted")
+# The function that writes the statements of outputFormat, and whether it
+# writes bytes. The machine-readable formats are only imported when asked for.
+def _writer():
+    match outputFormat:
+        case 'json':
+            from modules.rd_parcer import formats
+            return formats.writeJson, False
+        case 'binary':
+            from modules.rd_parcer import formats
+            return formats.writeBinary, True
+        case 'none':
+            return _discard, False
+        case _:
+            return printStmts, False
+
+# JSON and binary output is meant for other programs, so diagnostics and
+# "Accepted" go to stderr for them
+def _messages():
+    return sys.stderr if (outputFormat in ('json', 'binary')) else sys.stdout
+
+def _accepted():
+    print ("Accepted", file=_messages())
+
+def _output(binary: bool):
+    if (not binary): return sys.stdout
+    sys.stdout.flush()
+    return sys.stdout.buffer
+
+# parse is parallel.parse (the default), which splits large sources and
+# parses them in parallel, or cache.parse, which also looks them up in the
+# cache first. Only the statements are printed, so identifiers don't need
+# locations.
+def run(source:str, parse = None):
+    if (parse is None):
+        from modules import parallel
+        parse = parallel.parse
+    diagnostics = state.Diagnostics(maxErrors)
+    statements = parse(source, diagnostics, locations=False)
+
+    if (diagnostics.hadError):
+        diagnostics.render(_messages())
+        return
+    write, binary = _writer()
+    write(statements, _output(binary))
+    _accepted()
 
 
 def runPrompt():
@@ -25,19 +72,76 @@ def runPrompt():
         except EOFError: break
         except KeyboardInterrupt: break
         run(line)
-        state.hadError = False
+
+# Output of runStream() is kept in memory up to this size, and in a
+# temporary file after that
+_SPOOL_SIZE = 1 << 20
+
+# Like run(), but lexes and parses the file as it's read, printing each
+# statement as soon as it's parsed. The output is held back until the whole
+# file has been accepted, as run() does. Lexer errors are kept apart and
+# reported first, as the other paths do; a parser that stops early still
+# reads the rest of the tokens, so none of them are missed.
+def runStream(file):
+    import shutil
+    import tempfile
+
+    lexDiagnostics = state.Diagnostics(maxErrors)
+    parseDiagnostics = state.Diagnostics(maxErrors)
+    tokens = scanner.tokenize_stream(file, diagnostics=lexDiagnostics)
+    parser = RDParser(diagnostics=parseDiagnostics, locations=False)
+
+    write, binary = _writer()
+    with tempfile.SpooledTemporaryFile(_SPOOL_SIZE, 'w+b' if binary else 'w+') as output:
+        write(parser.iter_parse(tokens), output)
+
+        diagnostics = state.Diagnostics(maxErrors)
+        diagnostics.merge(lexDiagnostics)
+        diagnostics.merge(parseDiagnostics)
+        if (diagnostics.hadError):
+            diagnostics.render(_messages())
+            return
+        output.seek(0)
+        shutil.copyfileobj(output, _output(binary))
+    _accepted()
 
 def runFile(path):
-    with open(path) as file:
-        run(file.read())
-
-match len(sys.argv)-1:
-    case 0:
-        runPrompt()
-    case 1:
-        path = sys.argv[1]
-        runFile(path)
-    case _:
-        sys.exit(64)
-        
+    # Bytes that aren't valid text become U+FFFD and are reported as illegal
+    # characters
+    with open(path, errors='replace') as file:
+        size = os.path.getsize(path)
+        # Files that were parsed before are looked up in the cache. Files that
+        # are worth splitting are parsed on all cores instead of as they're
+        # read.
+        from modules import cache
+        from modules import parallel
+        if (size <= cache.maxSourceSize):
+            run(file.read(), cache.parse)
+        elif ((os.cpu_count() or 1) > 1 and size >= 2 * parallel.minChunkSize):
+            run(file.read())
+        else:
+            runStream(file)
+
+# Workers of parallel.parse import this module again when processes are
+# spawned, so only the script itself runs the command line
+if __name__ == '__main__':
+    # --format=NAME can come anywhere on the command line
+    args = []
+    for arg in sys.argv[1:]:
+        if (not arg.startswith('--format=')):
+            args.append(arg)
+            continue
+        outputFormat = arg.removeprefix('--format=')
+        if (outputFormat not in outputFormats):
+            print(f"notc: unknown format '{outputFormat}', expected one of:",
+                  ', '.join(outputFormats), file=sys.stderr)
+            sys.exit(64)
 
+    match len(args):
+        case 0:
+            runPrompt()
+        case 1:
+            path = args[0]
+            runFile(path)
+        case _:
+            sys.exit(64)